@@ -0,0 +1,356 @@
+import os
+import threading
+
+import numpy as np
+import psycopg2.extras
+
+# Topologia usada para popular pu_racks e como reserva quando a tabela está vazia
+TOPOLOGIA_PADRAO = [
+    {'nome': 'RACK1', 'numero_inicio': 1, 'numero_fim': 28, 'colunas': 'E-M,D-A', 'prioridade': 1},
+    {'nome': 'RACK2', 'numero_inicio': 29, 'numero_fim': 56, 'colunas': 'E-M,D-A', 'prioridade': 2},
+    {'nome': 'RACK3', 'numero_inicio': 57, 'numero_fim': 84, 'colunas': 'E-M,D-A', 'prioridade': 3}
+]
+
+# Tempo de vida das reservas de locais feitas por uma sessão de coleta
+RESERVA_TTL_MINUTOS = int(os.getenv('RESERVA_TTL_MINUTOS', '30'))
+
+# Ordem de preenchimento compilada, mantida em memória enquanto a versão da topologia no banco
+# (pu_topologia_versao, incrementada por triggers em pu_locais e pu_racks) não mudar
+_cache_sequencia = None
+_lock_sequencia = threading.Lock()
+
+
+def letras_faixa(faixa):
+    """Converte uma faixa de colunas como 'E-M' ou 'D-A' na lista de letras, na ordem indicada"""
+    inicio, _, fim = faixa.strip().upper().partition('-')
+    fim = fim or inicio
+    passo = 1 if ord(fim) >= ord(inicio) else -1
+    return [chr(code) for code in range(ord(inicio), ord(fim) + passo, passo)]
+
+
+def compilar_sequencia(racks, locais_por_rack):
+    """Gera a ordem de preenchimento: para cada rack, cada faixa de colunas é preenchida em todas as linhas antes da próxima"""
+    sequencia = []
+
+    for rack in sorted(racks, key=lambda r: r['prioridade']):
+        locais_rack = locais_por_rack.get(rack['nome'])
+        if not locais_rack:
+            continue
+
+        for faixa in rack['colunas'].split(','):
+            letras = letras_faixa(faixa)
+            for num in range(rack['numero_inicio'], rack['numero_fim'] + 1):
+                for letra in letras:
+                    local = f"{letra}{num}"
+                    if local in locais_rack:
+                        sequencia.append((local, 'COLMEIA'))
+
+    return tuple(sequencia)
+
+
+def obter_sequencia(conn):
+    """Retorna a topologia compilada (sequência, capacidades, posições), recompilando quando a versão no banco muda
+
+    A versão é lida antes dos locais: uma alteração concorrente no máximo força mais uma recompilação,
+    e alterações feitas por qualquer processo chegam a todos os workers na próxima alocação.
+    """
+    global _cache_sequencia
+
+    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cur.execute("SELECT versao FROM public.pu_topologia_versao")
+    row = cur.fetchone()
+    versao = row[0] if row else None
+
+    cache = _cache_sequencia
+    if cache is not None and cache['versao'] == versao:
+        return cache
+
+    with _lock_sequencia:
+        if _cache_sequencia is not None and _cache_sequencia['versao'] == versao:
+            return _cache_sequencia
+
+
+        cur.execute("SELECT nome, numero_inicio, numero_fim, colunas, prioridade FROM public.pu_racks WHERE ativo ORDER BY prioridade, nome")
+        racks = [dict(row) for row in cur.fetchall()] or TOPOLOGIA_PADRAO
+
+        cur.execute("SELECT local, nome, capacidade FROM public.pu_locais WHERE status = 'Ativo'")
+        locais_ativos = cur.fetchall()
+
+        locais_por_rack = {}
+        capacidade_por_local = {}
+        rack_por_local = {}
+        for row in locais_ativos:
+            locais_por_rack.setdefault(row['nome'], set()).add(row['local'])
+            capacidade_por_local[row['local']] = max(row['capacidade'] or 1, 1)
+            rack_por_local[row['local']] = row['nome']
+
+        sequencia = compilar_sequencia(racks, locais_por_rack)
+        _cache_sequencia = {
+            'versao': versao,
+            'sequencia': sequencia,
+            'capacidades': np.array([capacidade_por_local[local] for local, _ in sequencia], dtype=np.int32),
+            'racks': tuple(rack_por_local[local] for local, _ in sequencia),
+            'posicoes': {local: posicao for posicao, (local, _) in enumerate(sequencia)},
+            'total_ativos': len(locais_ativos)
+        }
+        return _cache_sequencia
+
+
+def invalidar_sequencia():
+    """Descarta a ordem de preenchimento compilada deste processo; a próxima alocação recompila a partir do banco"""
+    global _cache_sequencia
+    with _lock_sequencia:
+        _cache_sequencia = None
+
+
+class IndiceOcupacao:
+    """Ocupação dos locais carregada uma única vez por requisição e resolvida em memória
+
+    A ocupação fica em arrays alinhados com a ordem de preenchimento: quantidade de peças,
+    capacidade e código do tipo de peça de cada local (VAZIO ou MISTO quando não há um tipo único).
+    """
+
+    VAZIO = -1
+    MISTO = -2
+    BLOCO_BUSCA = 64
+
+    def __init__(self, topologia, linhas_ocupacao):
+        self.sequencia = topologia['sequencia']
+        self.posicoes = topologia['posicoes']
+        self.total_ativos = topologia['total_ativos']
+        self.capacidades = topologia['capacidades']
+        self.racks = topologia['racks']
+        self.quantidades = np.zeros(len(self.sequencia), dtype=np.int32)
+        self.tipos = np.full(len(self.sequencia), self.VAZIO, dtype=np.int32)
+        self._codigos = {}
+        # Por tipo de peça, posição antes da qual nenhum local serve mais para esse tipo
+        self._inicio_por_tipo = {}
+
+        for local, peca, quantidade in linhas_ocupacao:
+            posicao = self.posicoes.get(local)
+            if posicao is not None and quantidade > 0:
+                self._registrar(posicao, peca, quantidade)
+
+    @classmethod
+    def carregar(cls, conn, excluir_sessao=None):
+        """Monta o índice a partir da topologia em cache e de uma única consulta de ocupação (incluindo reservas ativas)
+
+        As reservas de excluir_sessao não contam como ocupação, para simulações das peças que a própria sessão coletou.
+        """
+        topologia = obter_sequencia(conn)
+
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT local, peca, estoque + otimizadas + manuais FROM public.pu_ocupacao
+            UNION ALL
+            SELECT local, peca, COUNT(*) FROM public.pu_reservas
+            WHERE expira_em > NOW() AND sessao IS DISTINCT FROM %s
+            GROUP BY local, peca
+        """, (excluir_sessao,))
+        return cls(topologia, cur.fetchall())
+
+    def _codigo(self, tipo_peca):
+        return self._codigos.setdefault(tipo_peca or '', len(self._codigos))
+
+    def _registrar(self, posicao, tipo_peca, quantidade=1):
+        codigo = self._codigo(tipo_peca)
+        self.quantidades[posicao] += quantidade
+        if self.tipos[posicao] == self.VAZIO:
+            self.tipos[posicao] = codigo
+        elif self.tipos[posicao] != codigo:
+            self.tipos[posicao] = self.MISTO
+
+    def _aceita(self, inicio, fim, codigo):
+        """Máscara dos locais em [inicio, fim) com capacidade restante e vazios ou com o mesmo tipo"""
+        tipos = self.tipos[inicio:fim]
+        return (self.quantidades[inicio:fim] < self.capacidades[inicio:fim]) & ((tipos == self.VAZIO) | (tipos == codigo))
+
+    def sugerir(self, tipo_peca, bloqueados=None):
+        """Retorna o primeiro local da sequência com espaço para o tipo de peça, ou (None, None)"""
+        codigo = self._codigo(tipo_peca)
+        total = len(self.sequencia)
+        posicao = self._inicio_por_tipo.get(codigo, 0)
+        avancar = True
+
+        # Busca vetorizada em blocos a partir do cursor do tipo; a ocupação só cresce durante a requisição
+        while posicao < total:
+            fim = min(posicao + self.BLOCO_BUSCA, total)
+            livres = np.flatnonzero(self._aceita(posicao, fim, codigo))
+
+            for livre in livres:
+                encontrada = posicao + int(livre)
+                if avancar:
+                    self._inicio_por_tipo[codigo] = encontrada
+                local, rack = self.sequencia[encontrada]
+                if bloqueados and local in bloqueados:
+                    avancar = False
+                    continue
+                return local, rack
+
+            if avancar:
+                self._inicio_por_tipo[codigo] = fim
+            posicao = fim
+
+        return None, None
+
+    def ocupar(self, local, tipo_peca):
+        """Registra no índice uma peça alocada no local nesta requisição"""
+        posicao = self.posicoes.get(local)
+        if posicao is not None:
+            self._registrar(posicao, tipo_peca)
+
+    def bloquear(self, local):
+        """Marca o local como cheio (por exemplo, quando outra sessão o reservou primeiro)"""
+        posicao = self.posicoes.get(local)
+        if posicao is not None:
+            self.quantidades[posicao] = max(self.quantidades[posicao], self.capacidades[posicao])
+
+    def locais_livres(self):
+        """Quantidade de locais com capacidade restante"""
+        return int(np.count_nonzero(self.quantidades < self.capacidades))
+
+    def vagas_por_rack(self):
+        """Peças que ainda cabem em cada rack, somando a capacidade restante dos locais"""
+        restantes = np.maximum(self.capacidades - self.quantidades, 0)
+        vagas = {}
+        for rack, restante in zip(self.racks, restantes.tolist()):
+            vagas[rack] = vagas.get(rack, 0) + restante
+        return vagas
+
+
+def alocar_lote(indice, pecas):
+    """Aloca uma lista de peças (op, peca, projeto) em uma única passada sobre o índice"""
+    alocacoes = []
+
+    for peca in pecas:
+        tipo_peca = peca.get('peca', '')
+        local, rack = indice.sugerir(tipo_peca)
+
+        if local and rack:
+            indice.ocupar(local, tipo_peca)
+        else:
+            local, rack = 'SEM LOCAL', 'N/A'
+
+        alocacoes.append({
+            'op': peca.get('op', ''),
+            'peca': tipo_peca,
+            'projeto': peca.get('projeto', ''),
+            'local': local,
+            'rack': rack
+        })
+
+    return alocacoes
+
+
+def simular_capacidade(indice, pecas):
+    """Simula a alocação das peças apenas no índice em memória, sem gravar nada nem reservar locais"""
+    vagas_antes = indice.vagas_por_rack()
+    alocacoes = alocar_lote(indice, pecas)
+
+    excedentes = [i for i, alocacao in enumerate(alocacoes) if alocacao['local'] == 'SEM LOCAL']
+    locais_usados = list(dict.fromkeys(alocacao['local'] for alocacao in alocacoes if alocacao['local'] != 'SEM LOCAL'))
+
+    primeiro_excedente = None
+    if excedentes:
+        primeiro_excedente = {'posicao': excedentes[0], **{campo: alocacoes[excedentes[0]][campo] for campo in ('op', 'peca', 'projeto')}}
+
+    vagas_depois = indice.vagas_por_rack()
+    return {
+        'total': len(alocacoes),
+        'cabem': len(alocacoes) - len(excedentes),
+        'excedentes': len(excedentes),
+        'primeiro_excedente': primeiro_excedente,
+        'locais_usados': locais_usados,
+        'por_rack': {
+            rack: {'usadas': vagas_antes[rack] - vagas_depois[rack], 'vagas_restantes': vagas_depois[rack]}
+            for rack in vagas_antes
+        },
+        'alocacoes': alocacoes
+    }
+
+
+def reservar_locais(conn, sessao, alocacoes, usuario=None, ttl_minutos=RESERVA_TTL_MINUTOS):
+    """Reserva atomicamente os locais das alocações para a sessão e retorna, para cada alocação, se foi reservada"""
+    cur = conn.cursor()
+    locais = sorted({alocacao['local'] for alocacao in alocacoes})
+
+    # Reservas expiradas não contam mais e liberam espaço
+    cur.execute("DELETE FROM public.pu_reservas WHERE expira_em <= NOW()")
+
+    # Travar as linhas dos locais; os que outra sessão está reservando agora são pulados, sem espera
+    # Locais desativados depois que o índice foi carregado não são reservados
+    cur.execute("""
+        SELECT local, capacidade FROM public.pu_locais
+        WHERE local = ANY(%s) AND status = 'Ativo'
+        FOR UPDATE SKIP LOCKED
+    """, (locais,))
+    capacidades = {local: max(capacidade or 1, 1) for local, capacidade in cur.fetchall()}
+
+    # Ocupação atual dos locais travados, incluindo o que mudou depois que o índice foi carregado
+    travados = list(capacidades)
+    cur.execute("""
+        SELECT local, peca, estoque + otimizadas + manuais FROM public.pu_ocupacao WHERE local = ANY(%s)
+        UNION ALL
+        SELECT local, peca, COUNT(*) FROM public.pu_reservas WHERE local = ANY(%s) GROUP BY local, peca
+    """, (travados, travados))
+    quantidades, tipos = {}, {}
+    for local, peca, quantidade in cur.fetchall():
+        if quantidade > 0:
+            quantidades[local] = quantidades.get(local, 0) + quantidade
+            tipos.setdefault(local, set()).add(peca)
+
+    # Aceitar enquanto houver capacidade e o local estiver vazio ou com o mesmo tipo de peça
+    aceitas = []
+    for alocacao in alocacoes:
+        local, peca = alocacao['local'], alocacao['peca']
+        aceita = (
+            local in capacidades
+            and quantidades.get(local, 0) < capacidades[local]
+            and tipos.get(local, set()) <= {peca}
+        )
+        if aceita:
+            quantidades[local] = quantidades.get(local, 0) + 1
+            tipos.setdefault(local, set()).add(peca)
+        aceitas.append(aceita)
+
+    reservas = [
+        (alocacao['local'], sessao, str(alocacao['op']), alocacao['peca'], usuario, ttl_minutos)
+        for alocacao, aceita in zip(alocacoes, aceitas) if aceita
+    ]
+    if reservas:
+        psycopg2.extras.execute_values(cur, """
+            INSERT INTO public.pu_reservas (local, sessao, op, peca, usuario, expira_em) VALUES %s
+        """, reservas, template="(%s, %s, %s, %s, %s, NOW() + make_interval(mins => %s))")
+
+    conn.commit()
+    return aceitas
+
+
+def alocar_e_reservar(conn, indice, pecas, sessao, usuario=None, tentativas=3):
+    """Aloca as peças em memória e reserva os locais; locais tomados por outra sessão são realocados"""
+    alocacoes = alocar_lote(indice, pecas)
+    reservadas = set()
+
+    for _ in range(tentativas):
+        pendentes = [i for i, alocacao in enumerate(alocacoes) if alocacao['local'] != 'SEM LOCAL' and i not in reservadas]
+        if not pendentes:
+            break
+
+        aceitas = reservar_locais(conn, sessao, [alocacoes[i] for i in pendentes], usuario)
+        perdidas = [i for i, aceita in zip(pendentes, aceitas) if not aceita]
+        reservadas.update(i for i, aceita in zip(pendentes, aceitas) if aceita)
+
+        if not perdidas:
+            break
+
+        # Locais perdidos ficam cheios no índice, então a realocação segue para os próximos com espaço
+        for i in perdidas:
+            indice.bloquear(alocacoes[i]['local'])
+        for i, nova in zip(perdidas, alocar_lote(indice, [alocacoes[i] for i in perdidas])):
+            alocacoes[i]['local'], alocacoes[i]['rack'] = nova['local'], nova['rack']
+
+    for i, alocacao in enumerate(alocacoes):
+        if i not in reservadas:
+            alocacao['local'], alocacao['rack'] = 'SEM LOCAL', 'N/A'
+
+    return alocacoes
@@ -1,137 +1,292 @@
 import pandas as pd
 import os
+import sys
+import io
 import json
-import requests
 import time
+import argparse
+import requests
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
 from sqlalchemy import create_engine, text
 from loguru import logger
 
-def atualizar_apontamentos():
-    """Função para atualizar dados de apontamentos"""
+# Tempo máximo em segundos para a resposta da API do pplug
+PPLUG_TIMEOUT = int(os.getenv('PPLUG_TIMEOUT', '60'))
+
+# Intervalo em segundos entre as execuções do modo contínuo (--continuo)
+INGESTAO_INTERVALO = int(os.getenv('INGESTAO_INTERVALO', '120'))
+
+# Dias pedidos ao pplug por requisição ao recuperar um período atrasado
+INGESTAO_BLOCO_DIAS = int(os.getenv('INGESTAO_BLOCO_DIAS', '3'))
+
+# Dias já fechados buscados de novo a cada execução, para pegar apontamentos atrasados ou retroativos (mínimo 1)
+INGESTAO_RETROATIVO_DIAS = max(int(os.getenv('INGESTAO_RETROATIVO_DIAS', '1')), 1)
+
+# Sem watermark nem apontamentos no banco, a primeira carga começa este número de dias atrás
+INGESTAO_CARGA_INICIAL_DIAS = int(os.getenv('INGESTAO_CARGA_INICIAL_DIAS', '1'))
+
+# Chave do advisory lock que impede duas ingestões simultâneas (botão, jobs e modo contínuo)
+CHAVE_LOCK_INGESTAO = 7362002
+
+FONTE_PPLUG = 'pplug_jarinu'
+
+COLUNAS_NOMEADAS = {
+    'ID':'id',
+    'DATA':'data',
+    'ETAPA':'etapa',
+    'USUÁRIO':'usuario',
+    'COLABORADOR':'colaborador',
+    'CLIENTE':'cliente',
+    'OP':'op',
+    'PRIORIDADE':'prioridade',
+    'ITEM':'item',
+    'CÓD':'serial',
+    'MODELO':'modelo',
+    'OBS':'obs',
+    'CABINE':'cabine',
+    'ETAPA_RESP':'etapa_resp',
+    'MOTIVO':'motivo',
+    'RESUMO':'resumo',
+    'RTRP':'status',
+    'PRODUTO':'produto',
+    'PROJETO':'projeto',
+    'Veículo':'veiculo',
+    'CÓDIGO DE BARRAS':'codigo_de_barras',
+    'm2':'m2',
+    'Projeto + Peça':'projeto_peca',
+    'ETAPA_BAIXA':'etapa_refugo'
+}
+
+def _sem_progresso(etapa, **contagens):
+    pass
+
+def _criar_engine():
     load_dotenv()
-    
+    DB_HOST = os.getenv('DB_HOST')
+    DB_USER = os.getenv('DB_USER')
+    DB_PASSWORD = os.getenv('DB_PSW')
+    DB_PORT = os.getenv('DB_PORT')
+    DB_NAME = os.getenv('DB_NAME')
+    connection_string = f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
+    return create_engine(connection_string)
+
+def baixar_periodo(session, inicio, fim):
+    """Apontamentos do pplug entre as datas inicio e fim (inclusive), com as colunas originais"""
+    url = f"https://www.pplug.com.br/PP_pesquisa_api_vertco.php?etapa_aponta=TODAS&data_aponta={inicio.strftime('%y-%m-%d')}&data_fim={fim.strftime('%y-%m-%d')}&token=acessoJARINUconsulta"
+    headers = {'User-Agent': 'Mozilla/5.0'}
+
+    response = session.get(url, headers=headers, timeout=PPLUG_TIMEOUT)
+    response.raise_for_status()
+    response_clear = response.text[1:-1]
+    data = json.loads(response_clear) if response_clear.strip() else []
+
+    df = pd.DataFrame(data)
+    if len(df) <= 1:
+        return pd.DataFrame(columns=list(COLUNAS_NOMEADAS))
+    df.columns = df.iloc[0]             # define colunas reais
+    return df.drop([0]).reset_index(drop=True)
+
+def transformar_apontamentos(df, df_m2):
+    """Converte o retorno do pplug para as colunas e tipos de apontamento_pplug_jarinu"""
+    df['Veículo'] = df['MODELO'].apply(lambda x: ' '.join(x.split(' ')[2:]) if pd.notna(x) else None)
+
+    # Converte a data e gera colunas adicionais
+    df['DATA'] = pd.to_datetime(df['DATA'], dayfirst=True)
+    df['PROJETO'] = df['MODELO'].apply(lambda x: x.split(' ')[0] if pd.notna(x) else '')
+    df['ITEM'] = df['ITEM'].str[:3]
+    df['Projeto + Peça'] = df['PROJETO'] + df['ITEM']
+    df['CÓDIGO DE BARRAS'] = df['ITEM'] + df['OP'].astype(str)
+
+    # Merge com dados de metros quadrados do banco
+    df = pd.merge(left=df, right=df_m2.rename(columns={'projeto_peca': 'Projeto + Peça'}), on='Projeto + Peça', how='left')
+
+    df_apontamentos = df[[
+    'ID','DATA','ETAPA','USUÁRIO','COLABORADOR','CLIENTE','OP','PRIORIDADE','ITEM','CÓD',
+    'MODELO','OBS','CABINE','ETAPA_BAIXA','MOTIVO','RESUMO','RTRP','PRODUTO','ETAPA_RESP','PROJETO','Veículo',
+    'CÓDIGO DE BARRAS','m2','Projeto + Peça'
+    ]]
+
+    df_final = df_apontamentos.rename(columns=COLUNAS_NOMEADAS)
+
+    # Tratamento de tipos
+    df_final['id'] = df_final['id'].apply(lambda x: None if pd.isna(x) or x == '' else x).astype('Int64')
+    df_final['op'] = df_final['op'].apply(lambda x: None if pd.isna(x) or x == '' else x).astype('Int64')
+    df_final['data'] = pd.to_datetime(df_final['data'], errors='coerce')
+
+    for col in ['etapa', 'usuario', 'colaborador', 'cliente', 'prioridade', 'item']:
+        df_final[col] = df_final[col].replace("", None).astype(str)
+
+    df_final['id'] = df_final['id'].fillna(0).astype('int64')
+    df_final['op'] = df_final['op'].fillna(0).astype('int64')
+    return df_final
+
+def ler_watermark(connection):
+    """Último id/data ingeridos e o primeiro dia ainda não coberto por completo"""
+    row = connection.execute(text("""
+        SELECT ultimo_id, ultima_data, dia_aberto FROM public.pu_ingestao_watermark WHERE fonte = :fonte
+    """), {'fonte': FONTE_PPLUG}).fetchone()
+    if row:
+        return {'ultimo_id': row[0] or 0, 'ultima_data': row[1], 'dia_aberto': row[2]}
+
+    # Primeira execução: parte do que já está na tabela de apontamentos
+    row = connection.execute(text("SELECT MAX(id), MAX(data) FROM public.apontamento_pplug_jarinu")).fetchone()
+    ultimo_id, ultima_data = (row[0], row[1]) if row else (None, None)
+    dia_aberto = ultima_data.date() if ultima_data else datetime.today().date() - timedelta(days=INGESTAO_CARGA_INICIAL_DIAS)
+    return {'ultimo_id': ultimo_id or 0, 'ultima_data': ultima_data, 'dia_aberto': dia_aberto}
+
+def gravar_watermark(connection, watermark):
+    connection.execute(text("""
+        INSERT INTO public.pu_ingestao_watermark (fonte, ultimo_id, ultima_data, dia_aberto, atualizado_em)
+        VALUES (:fonte, :ultimo_id, :ultima_data, :dia_aberto, CURRENT_TIMESTAMP)
+        ON CONFLICT (fonte) DO UPDATE SET
+            ultimo_id = EXCLUDED.ultimo_id, ultima_data = EXCLUDED.ultima_data,
+            dia_aberto = EXCLUDED.dia_aberto, atualizado_em = EXCLUDED.atualizado_em
+    """), {'fonte': FONTE_PPLUG, **watermark})
+
+def carregar_lote(conn, df):
+    """Transmite o lote com COPY FROM STDIN para uma tabela temporária e o mescla em apontamento_pplug_jarinu; devolve as linhas inseridas"""
+    colunas = ', '.join(df.columns)
+
+    # CSV montado em memória: campos vazios (NA, NaT, None) chegam como NULL
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, date_format='%Y-%m-%d %H:%M:%S.%f')
+    buffer.seek(0)
+
+    cur = conn.cursor()
+    cur.execute("""
+        CREATE TEMP TABLE apontamento_staging
+        (LIKE public.apontamento_pplug_jarinu INCLUDING DEFAULTS) ON COMMIT DROP
+    """)
+    cur.copy_expert(f"COPY apontamento_staging ({colunas}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+    # O índice único em id descarta o que já existe; o custo depende do lote, não do histórico
+    cur.execute(f"""
+        INSERT INTO public.apontamento_pplug_jarinu ({colunas})
+        SELECT {colunas} FROM apontamento_staging
+        ON CONFLICT (id) DO NOTHING
+    """)
+    return cur.rowcount
+
+def _inserir_novos(engine, df_final):
+    """Grava os apontamentos do lote ainda ausentes do banco; devolve quantos entraram"""
+    df_novo = df_final.copy()
+    df_novo.columns = df_novo.columns.str.strip()
+    df_novo = df_novo.map(lambda x: None if x == '' else x)
+    df_novo.drop_duplicates(subset=['id'], inplace=True)
+    if df_novo.empty:
+        return 0
+
+    conn = engine.raw_connection()
+    try:
+        inseridos = carregar_lote(conn, df_novo)
+        conn.commit()
+        return inseridos
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def atualizar_apontamentos(progresso=_sem_progresso):
+    """Ingere os apontamentos novos a partir do watermark, em blocos de dias; progresso(etapa, **contagens) acompanha as etapas"""
+    engine = None
     try:
-        DB_HOST = os.getenv('DB_HOST')
-        DB_USER = os.getenv('DB_USER')
-        DB_PASSWORD = os.getenv('DB_PSW')
-        DB_PORT = os.getenv('DB_PORT')
-        DB_NAME = os.getenv('DB_NAME')
-        connection_string = f'postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}'
-
-        ontem = (datetime.today() - timedelta(days=1)).strftime('%y-%m-%d')
-        hoje = datetime.today().strftime('%y-%m-%d')
-
-        url = f"https://www.pplug.com.br/PP_pesquisa_api_vertco.php?etapa_aponta=TODAS&data_aponta={ontem}&data_fim={hoje}&token=acessoJARINUconsulta"
-        headers = {'User-Agent': 'Mozilla/5.0'}
-
-        logger.info(f"Iniciando a seção")
-        time.sleep(5)
-        session = requests.Session()
-        response = session.get(url, headers=headers)
-        response_clear = response.text[1:-1]
-        data = json.loads(response_clear)
-
-        df = pd.DataFrame(data)
-        df.columns = df.iloc[0]             # define colunas reais
-        df = df.drop([0]).reset_index(drop=True)
-
-
-        df['Veículo'] = df['MODELO'].apply(lambda x: ' '.join(x.split(' ')[2:]) if pd.notna(x) else None)
-
-        # Converte a data e gera colunas adicionais
-        df['DATA'] = pd.to_datetime(df['DATA'], dayfirst=True)
-        df['PROJETO'] = df['MODELO'].apply(lambda x: x.split(' ')[0] if pd.notna(x) else '')
-        df['ITEM'] = df['ITEM'].str[:3]
-        df['Projeto + Peça'] = df['PROJETO'] + df['ITEM']
-        df['CÓDIGO DE BARRAS'] = df['ITEM'] + df['OP'].astype(str)
-
-        # Merge com dados de metros quadrados do banco
-        engine = create_engine(connection_string)
-        with engine.connect() as connection:
-            query_m2 = text("SELECT projeto_peca, m2 FROM dados_uso_geral.metro_quadrado_pecas")
-            df_m2 = pd.read_sql(query_m2, connection)
-        df = pd.merge(left=df, right=df_m2.rename(columns={'projeto_peca': 'Projeto + Peça'}), on='Projeto + Peça', how='left')
-
-        # Agora sim pode usá-la no df_apontamentos
-        df_apontamentos = df[[
-        'ID','DATA','ETAPA','USUÁRIO','COLABORADOR','CLIENTE','OP','PRIORIDADE','ITEM','CÓD',
-        'MODELO','OBS','CABINE','ETAPA_BAIXA','MOTIVO','RESUMO','RTRP','PRODUTO','ETAPA_RESP','PROJETO','Veículo',
-        'CÓDIGO DE BARRAS','m2','Projeto + Peça'
-        ]]
-
-        colunas_nomeadas = {
-            'ID':'id',
-            'DATA':'data',
-            'ETAPA':'etapa',
-            'USUÁRIO':'usuario',
-            'COLABORADOR':'colaborador',
-            'CLIENTE':'cliente',
-            'OP':'op',
-            'PRIORIDADE':'prioridade',
-            'ITEM':'item',
-            'CÓD':'serial',
-            'MODELO':'modelo',
-            'OBS':'obs',
-            'CABINE':'cabine',
-            'ETAPA_RESP':'etapa_resp',
-            'MOTIVO':'motivo',
-            'RESUMO':'resumo',
-            'RTRP':'status',
-            'PRODUTO':'produto',
-            'PROJETO':'projeto',
-            'Veículo':'veiculo',
-            'CÓDIGO DE BARRAS':'codigo_de_barras',
-            'm2':'m2',
-            'Projeto + Peça':'projeto_peca',
-            'ETAPA_BAIXA':'etapa_refugo'
-        }
-
-        df_final = df_apontamentos.rename(columns=colunas_nomeadas)
-
-        # Tratamento de tipos
-        df_final['id'] = df_final['id'].apply(lambda x: None if pd.isna(x) or x == '' else x).astype('Int64')
-        df_final['op'] = df_final['op'].apply(lambda x: None if pd.isna(x) or x == '' else x).astype('Int64')
-        df_final['data'] = pd.to_datetime(df_final['data'], errors='coerce')
-
-        for col in ['etapa', 'usuario', 'colaborador', 'cliente', 'prioridade', 'item']:
-            df_final[col] = df_final[col].replace("", None).astype(str)
-
-        # Verificação e conexão
-
-        with engine.connect() as connection:
-            query = text(f"SELECT id, data FROM public.apontamento_pplug_jarinu")
-            existing_data = pd.read_sql(query, connection)
-
-        df_final['id'] = df_final['id'].fillna(0).astype('int64')
-        existing_data['id'] = existing_data['id'].astype(int)
-        df_final['data'] = pd.to_datetime(df_final['data'], errors='coerce')
-        existing_data['data'] = pd.to_datetime(existing_data['data'], errors='coerce')
-        df_final['op'] = df_final['op'].fillna(0).astype('int64')
-
-        # Remove duplicatas
-        df_novo = df_final[~df_final['id'].isin(existing_data['id']) & ~df_final['data'].isin(existing_data['data'])]
-        df_novo.columns = df_novo.columns.str.strip()
-        df_novo = df_novo.map(lambda x: None if x == '' else x)
-        df_novo['id'] = df_novo['id'].astype(pd.Int64Dtype())
-        df_novo['op'] = df_novo['op'].astype(pd.Int64Dtype())
-        df_novo.drop_duplicates(subset=['id'], inplace=True)
-
-        if not df_novo.empty:
-            df_novo.to_sql('apontamento_pplug_jarinu', engine, schema='public', index=False, if_exists='append')
-            logger.info(f"{len(df_novo)} novos registros inseridos.")
+        engine = _criar_engine()
+
+        with engine.connect() as trava:
+            # Botão, jobs de outros processos e o modo contínuo compartilham o mesmo lock
+            if not trava.execute(text("SELECT pg_try_advisory_lock(:chave)"), {'chave': CHAVE_LOCK_INGESTAO}).scalar():
+                logger.warning("Outra ingestão já está em andamento.")
+                return {"success": True, "message": "Outra ingestão já está em andamento", "linhas_recebidas": 0, "linhas_inseridas": 0}
+
+            try:
+                with engine.connect() as connection:
+                    watermark = ler_watermark(connection)
+                    df_m2 = pd.read_sql(text("SELECT projeto_peca, m2 FROM dados_uso_geral.metro_quadrado_pecas"), connection)
+
+                hoje = datetime.today().date()
+                # O ON CONFLICT (id) torna a nova busca dos dias já fechados idempotente
+                inicio = min(watermark['dia_aberto'], hoje - timedelta(days=INGESTAO_RETROATIVO_DIAS))
+                total_blocos = (hoje - inicio).days // INGESTAO_BLOCO_DIAS + 1
+                linhas_recebidas = linhas_inseridas = 0
+                session = requests.Session()
+
+                logger.info(f"Iniciando a seção: {inicio} a {hoje} em {total_blocos} bloco(s), último id conhecido {watermark['ultimo_id']}")
+                for bloco in range(1, total_blocos + 1):
+                    fim = min(inicio + timedelta(days=INGESTAO_BLOCO_DIAS - 1), hoje)
+                    progresso('baixando', bloco=bloco, total_blocos=total_blocos, periodo=f'{inicio}..{fim}')
+
+                    df = baixar_periodo(session, inicio, fim)
+                    linhas_recebidas += len(df)
+
+                    if not df.empty:
+                        df_final = transformar_apontamentos(df, df_m2)
+                        # O bloco inteiro vai para o merge: apontamentos atrasados ou retroativos podem ter id
+                        # menor que o último já visto, e o ON CONFLICT (id) já descarta o que existe
+                        sem_id = int((df_final['id'] == 0).sum())
+                        if sem_id:
+                            logger.warning(f"{sem_id} apontamento(s) sem id no bloco {inicio}..{fim}.")
+                        linhas_inseridas += _inserir_novos(engine, df_final)
+                        # ultimo_id e ultima_data só informam até onde a ingestão chegou; não filtram o lote
+                        watermark['ultimo_id'] = max(watermark['ultimo_id'], int(df_final['id'].max()))
+                        ultima_data = df_final['data'].max()
+                        if pd.notna(ultima_data):
+                            watermark['ultima_data'] = max(filter(None, [watermark['ultima_data'], ultima_data.to_pydatetime()]))
+
+                    # Dias anteriores a hoje estão completos; o dia corrente continua aberto
+                    watermark['dia_aberto'] = fim + timedelta(days=1) if fim < hoje else hoje
+                    with engine.begin() as connection:
+                        gravar_watermark(connection, watermark)
+                    progresso('inserindo', linhas_recebidas=linhas_recebidas, linhas_inseridas=linhas_inseridas)
+                    inicio = fim + timedelta(days=1)
+            finally:
+                trava.execute(text("SELECT pg_advisory_unlock(:chave)"), {'chave': CHAVE_LOCK_INGESTAO})
+
+        if linhas_inseridas:
+            logger.info(f"{linhas_inseridas} novos registros inseridos.")
         else:
             logger.warning("Nenhum novo dado para inserir.")
 
-        engine.dispose()
+        return {"success": True, "message": "Dados atualizados com sucesso", "linhas_recebidas": linhas_recebidas, "linhas_inseridas": linhas_inseridas, "ultimo_id": watermark['ultimo_id']}
 
-        return {"success": True, "message": "Dados atualizados com sucesso"}
-        
     except Exception as e:
         logger.error(f"Erro durante o processo: {e}")
         return {"success": False, "message": str(e)}
+    finally:
+        if engine is not None:
+            engine.dispose()
+
+def executar_continuamente(intervalo=INGESTAO_INTERVALO):
+    """Ingestão contínua: aplica o esquema uma vez e chama atualizar_apontamentos a cada intervalo"""
+    from esquema import aplicar_esquema
+
+    engine = _criar_engine()
+    conn = engine.raw_connection()
+    try:
+        aplicar_esquema(conn)
+    finally:
+        conn.close()
+        engine.dispose()
+
+    logger.info(f"Ingestão contínua a cada {intervalo}s")
+    while True:
+        inicio = time.monotonic()
+        resultado = atualizar_apontamentos()
+        logger.info(f"Ingestão: {resultado}")
+        time.sleep(max(intervalo - (time.monotonic() - inicio), 1))
 
 if __name__ == "__main__":
-    result = atualizar_apontamentos()
-    print(result)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Ingestão de apontamentos do pplug')
+    parser.add_argument('--continuo', action='store_true', help='executa em laço, a cada --intervalo segundos')
+    parser.add_argument('--intervalo', type=int, default=INGESTAO_INTERVALO)
+    args = parser.parse_args()
+
+    if args.continuo:
+        try:
+            executar_continuamente(args.intervalo)
+        except KeyboardInterrupt:
+            sys.exit(0)
+    else:
+        result = atualizar_apontamentos()
+        print(result)
@@ -1,24 +1,34 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_file, make_response
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_file, make_response, session, g, has_app_context, has_request_context, Response, stream_with_context
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
 from datetime import datetime, timezone, timedelta
 import psycopg2
 import psycopg2.extras
+import psycopg2.extensions
+import psycopg2.pool
 import pandas as pd
 import json
 import io
 import os
+import re
+import uuid
+import time
+import threading
 import smtplib
+from contextlib import contextmanager
+from functools import wraps
+from collections import OrderedDict
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from apontamentos_pplug_jarinu import atualizar_apontamentos
+from alocacao import IndiceOcupacao, alocar_lote, alocar_e_reservar, simular_capacidade, invalidar_sequencia
+from esquema import aplicar_esquema, EXPRESSAO_BUSCA_LOGS, EXPRESSAO_BUSCA_SAIDAS
+from jobs import iniciar_job, obter_job
 
-# Verificar se arquivo .env existe
+# Em contêineres as variáveis vêm do ambiente; o .env é opcional e não bloqueia a importação
 if not os.path.exists('.env'):
-    print("ERRO: Arquivo .env não encontrado!")
-    input("Pressione Enter para sair...")
-    exit(1)
+    print("Aviso: arquivo .env não encontrado, usando apenas as variáveis de ambiente")
 
 load_dotenv()
 
@@ -46,23 +56,14 @@ login_manager.login_view = 'login'
 login_manager.session_protection = None
 
 # Configuração do banco PostgreSQL
-DB_CONFIG = {
-    'host': os.getenv('DB_HOST'),
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PSW'),
-    'port': os.getenv('DB_PORT'),
-    'database': os.getenv('DB_NAME')
-}
-
-# Verificar se todas as variáveis foram carregadas
-if not all(DB_CONFIG.values()):
-    print("ERRO: Variáveis de ambiente do banco não configuradas!")
-    print(f"Valores carregados: {DB_CONFIG}")
-    input("Pressione Enter para sair...")
-    exit(1)
-
-print("Configurações carregadas com sucesso!")
-print(f"Conectando ao banco: {DB_CONFIG['host']}")
+VARIAVEIS_DB = {'host': 'DB_HOST', 'user': 'DB_USER', 'password': 'DB_PSW', 'port': 'DB_PORT', 'database': 'DB_NAME'}
+DB_CONFIG = {chave: os.getenv(variavel) for chave, variavel in VARIAVEIS_DB.items()}
+
+def verificar_configuracao():
+    """Interrompe a inicialização se faltar alguma variável do banco"""
+    faltando = [variavel for chave, variavel in VARIAVEIS_DB.items() if not DB_CONFIG.get(chave)]
+    if faltando:
+        raise RuntimeError(f"Variáveis de ambiente do banco não configuradas: {', '.join(faltando)}")
 
 def enviar_email_credenciais(email_destino, usuario, senha):
     """Envia email com credenciais do usuário"""
@@ -122,20 +123,371 @@ class User(UserMixin):
         self.role = funcao
         self.setor = setor
 
+# Usuários carregados recentemente (LRU com validade), para não consultar users_pu a cada requisição.
+# Edições e exclusões feitas em qualquer processo incrementam pu_usuarios_versao (trigger); cada processo
+# confere essa versão no máximo a cada USUARIOS_VERSAO_INTERVALO segundos e esvazia o cache quando ela muda.
+USUARIOS_CACHE_TTL = int(os.getenv('USUARIOS_CACHE_TTL', '60'))
+USUARIOS_CACHE_MAX = int(os.getenv('USUARIOS_CACHE_MAX', '256'))
+USUARIOS_VERSAO_INTERVALO = float(os.getenv('USUARIOS_VERSAO_INTERVALO', '2'))
+_cache_usuarios = OrderedDict()
+_lock_usuarios = threading.Lock()
+_versao_usuarios = {'versao': None, 'verificada_em': None}
+
+def invalidar_usuario(user_id):
+    """Remove o usuário do cache para que a próxima requisição leia as permissões atuais do banco"""
+    with _lock_usuarios:
+        _cache_usuarios.pop(str(user_id), None)
+
+def _conferir_versao_usuarios():
+    """Esvazia o cache de usuários se users_pu mudou em qualquer processo desde a última conferência"""
+    agora = time.monotonic()
+    with _lock_usuarios:
+        verificada_em = _versao_usuarios['verificada_em']
+        if verificada_em is not None and agora - verificada_em < USUARIOS_VERSAO_INTERVALO:
+            return
+        _versao_usuarios['verificada_em'] = agora
+    
+    try:
+        with conexao_db() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT versao FROM public.pu_usuarios_versao")
+            row = cur.fetchone()
+        versao = row[0] if row else None
+    except Exception as e:
+        # Sem a versão não há como saber o que mudou: o cache é descartado
+        print(f"Aviso: versão de usuários indisponível: {e}")
+        versao = None
+    
+    with _lock_usuarios:
+        if versao is None or versao != _versao_usuarios['versao']:
+            _cache_usuarios.clear()
+            _versao_usuarios['versao'] = versao
+
 @login_manager.user_loader
 def load_user(user_id):
-    conn = psycopg2.connect(**DB_CONFIG)
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-    cur.execute("SELECT * FROM public.users_pu WHERE id = %s", (user_id,))
-    user_data = cur.fetchone()
-    conn.close()
+    chave = str(user_id)
+    _conferir_versao_usuarios()
+    with _lock_usuarios:
+        entrada = _cache_usuarios.get(chave)
+        if entrada and time.monotonic() - entrada[1] < USUARIOS_CACHE_TTL:
+            _cache_usuarios.move_to_end(chave)
+            return entrada[0]
+    
+    with conexao_db() as conn:
+        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cur.execute("SELECT * FROM public.users_pu WHERE id = %s", (user_id,))
+        user_data = cur.fetchone()
     
     if user_data:
-        return User(user_data['id'], user_data['usuario'], user_data['funcao'], user_data.get('setor', ''))
+        user = User(user_data['id'], user_data['usuario'], user_data['funcao'], user_data.get('setor', ''))
+        with _lock_usuarios:
+            _cache_usuarios[chave] = (user, time.monotonic())
+            _cache_usuarios.move_to_end(chave)
+            while len(_cache_usuarios) > USUARIOS_CACHE_MAX:
+                _cache_usuarios.popitem(last=False)
+        return user
+    
+    invalidar_usuario(chave)
     return None
 
+# Pool de conexões compartilhado pelas threads do processo
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+DB_POOL_ESPERA = float(os.getenv('DB_POOL_ESPERA', '10'))
+
+# Réplica de leitura opcional (string de conexão libpq) para as rotas marcadas com @leitura_replica.
+# Depois de uma escrita, a sessão lê do primário por DB_REPLICA_JANELA segundos (ler as próprias escritas).
+DB_REPLICA_DSN = os.getenv('DB_REPLICA_DSN', '').strip()
+DB_REPLICA_JANELA = float(os.getenv('DB_REPLICA_JANELA', '10'))
+# Tempo máximo para conectar à réplica e pausa, após uma falha dela, em que as leituras vão direto ao primário
+DB_REPLICA_TIMEOUT = int(os.getenv('DB_REPLICA_TIMEOUT', '3'))
+DB_REPLICA_PAUSA = float(os.getenv('DB_REPLICA_PAUSA', '30'))
+
+_lock_pool_db = threading.Lock()
+_pools_db = {nome: {'pool': None, 'pid': None, 'vagas': None} for nome in ('primario', 'replica')}
+_replica_pausada_ate = {'instante': 0.0}
+
+def _novas_estatisticas_pool():
+    return {
+        'checkouts': 0, 'em_uso': 0, 'pico_em_uso': 0, 'esgotamentos': 0,
+        'descartadas': 0, 'devolvidas_no_teardown': 0, 'espera_total_ms': 0.0, 'espera_max_ms': 0.0
+    }
+
+_estatisticas_pools = {'primario': _novas_estatisticas_pool(), 'replica': _novas_estatisticas_pool()}
+_estatisticas_replica = {'leituras_replica': 0, 'leituras_no_primario_pos_escrita': 0, 'falhas_replica': 0}
+
+class ConexaoPool:
+    """Conexão emprestada do pool; close() devolve ao pool em vez de encerrar a conexão"""
+    
+    def __init__(self, pool, vagas, conn, estatisticas, primario=True):
+        self._pool = pool
+        self._vagas = vagas
+        self._conn = conn
+        self._estatisticas = estatisticas
+        self._primario = primario
+    
+    def __getattr__(self, nome):
+        if self._conn is None:
+            raise psycopg2.InterfaceError('conexão já devolvida ao pool')
+        return getattr(self._conn, nome)
+    
+    def commit(self):
+        if self._conn is None:
+            raise psycopg2.InterfaceError('conexão já devolvida ao pool')
+        self._conn.commit()
+        # Escrita confirmada: as próximas leituras desta sessão vão ao primário até a réplica alcançá-la
+        if self._primario and DB_REPLICA_DSN and has_request_context():
+            session['ultima_escrita_db'] = time.time()
+    
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        
+        # Transação pendente ou com erro é desfeita; conexão quebrada é descartada
+        descartar = bool(conn.closed)
+        if not descartar and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                descartar = True
+        
+        with _lock_pool_db:
+            self._estatisticas['em_uso'] -= 1
+            if descartar:
+                self._estatisticas['descartadas'] += 1
+        if descartar and not self._primario:
+            # Conexão da réplica caiu durante a rota: as próximas leituras não insistem nela
+            _pausar_replica('conexão perdida durante a consulta')
+        try:
+            self._pool.putconn(conn, close=descartar)
+        except psycopg2.pool.PoolError:
+            # O pool foi recriado (fork ou fechar_pool_db) depois do empréstimo
+            conn.close()
+        finally:
+            self._vagas.release()
+
+def _criar_pool_db(nome):
+    if nome == 'replica':
+        # Sessões da réplica são somente leitura também do lado do servidor
+        return psycopg2.pool.ThreadedConnectionPool(
+            DB_POOL_MIN, DB_POOL_MAX, dsn=DB_REPLICA_DSN, connect_timeout=DB_REPLICA_TIMEOUT,
+            options='-c default_transaction_read_only=on'
+        )
+    return psycopg2.pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, **DB_CONFIG)
+
+def _obter_pool_db(nome='primario'):
+    """Cria o pool na primeira conexão de cada processo (conexões não sobrevivem a um fork)"""
+    estado = _pools_db[nome]
+    with _lock_pool_db:
+        if estado['pool'] is not None and estado['pid'] == os.getpid():
+            return estado['pool'], estado['vagas']
+    
+    # Conectar fora do lock: um banco lento não trava as threads que usam o outro pool
+    pool = _criar_pool_db(nome)
+    with _lock_pool_db:
+        if estado['pool'] is None or estado['pid'] != os.getpid():
+            estado['pool'] = pool
+            estado['pid'] = os.getpid()
+            estado['vagas'] = threading.BoundedSemaphore(DB_POOL_MAX)
+            pool = None
+        resultado = estado['pool'], estado['vagas']
+    if pool is not None:
+        # Outra thread publicou o pool primeiro
+        pool.closeall()
+    return resultado
+
+def _pausar_replica(motivo):
+    """Depois de uma falha da réplica, as leituras vão ao primário por DB_REPLICA_PAUSA segundos"""
+    print(f"Aviso: réplica de leitura indisponível, usando o primário por {DB_REPLICA_PAUSA:g}s: {motivo}")
+    with _lock_pool_db:
+        _estatisticas_replica['falhas_replica'] += 1
+        _replica_pausada_ate['instante'] = time.monotonic() + DB_REPLICA_PAUSA
+
+def fechar_pool_db():
+    """Encerra as conexões livres dos pools; o próximo empréstimo cria pools novos"""
+    for estado in _pools_db.values():
+        with _lock_pool_db:
+            pool, estado['pool'] = estado['pool'], None
+        if pool is not None and estado['pid'] == os.getpid():
+            pool.closeall()
+
+def leitura_replica(rota):
+    """Marca uma rota somente leitura: suas conexões vêm da réplica, quando configurada"""
+    @wraps(rota)
+    def rota_replica(*args, **kwargs):
+        g.leitura_replica = True
+        return rota(*args, **kwargs)
+    return rota_replica
+
+def _usar_replica():
+    """A requisição é de uma rota somente leitura e a sessão não escreveu há pouco no primário"""
+    if not DB_REPLICA_DSN or not has_request_context() or not g.get('leitura_replica'):
+        return False
+    if time.monotonic() < _replica_pausada_ate['instante']:
+        return False
+    if time.time() - session.get('ultima_escrita_db', 0) < DB_REPLICA_JANELA:
+        with _lock_pool_db:
+            _estatisticas_replica['leituras_no_primario_pos_escrita'] += 1
+        return False
+    return True
+
+def _emprestar_conexao(nome):
+    pool, vagas = _obter_pool_db(nome)
+    estatisticas = _estatisticas_pools[nome]
+    
+    # Aguarda uma conexão livre por até DB_POOL_ESPERA segundos
+    inicio = time.monotonic()
+    if not vagas.acquire(timeout=DB_POOL_ESPERA):
+        with _lock_pool_db:
+            estatisticas['esgotamentos'] += 1
+        raise psycopg2.pool.PoolError(f'Nenhuma conexão livre no pool após {DB_POOL_ESPERA:g}s')
+    espera_ms = (time.monotonic() - inicio) * 1000
+    
+    try:
+        conn = pool.getconn()
+        if conn.closed:
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+        if nome == 'replica':
+            # Conexão da réplica que caiu enquanto estava livre falha aqui, e a leitura ainda pode ir ao primário
+            try:
+                conn.cursor().execute("SELECT 1")
+                conn.rollback()
+            except psycopg2.Error:
+                pool.putconn(conn, close=True)
+                raise
+    except Exception:
+        vagas.release()
+        raise
+    
+    with _lock_pool_db:
+        estatisticas['checkouts'] += 1
+        estatisticas['em_uso'] += 1
+        estatisticas['pico_em_uso'] = max(estatisticas['pico_em_uso'], estatisticas['em_uso'])
+        estatisticas['espera_total_ms'] += espera_ms
+        estatisticas['espera_max_ms'] = max(estatisticas['espera_max_ms'], espera_ms)
+    
+    return ConexaoPool(pool, vagas, conn, estatisticas, primario=(nome == 'primario'))
+
 def get_db_connection():
-    return psycopg2.connect(**DB_CONFIG)
+    conexao = None
+    if _usar_replica():
+        try:
+            conexao = _emprestar_conexao('replica')
+            with _lock_pool_db:
+                _estatisticas_replica['leituras_replica'] += 1
+        except psycopg2.Error as e:
+            # Réplica indisponível ou esgotada: a leitura segue no primário
+            _pausar_replica(e)
+    if conexao is None:
+        conexao = _emprestar_conexao('primario')
+    
+    # Dentro de uma requisição, o teardown devolve as conexões que a rota não fechou
+    if has_app_context():
+        g.setdefault('conexoes_db', []).append(conexao)
+    return conexao
+
+@contextmanager
+def conexao_db():
+    """Empresta uma conexão do pool e a devolve ao final do bloco, mesmo em caso de exceção"""
+    conn = get_db_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+@app.teardown_appcontext
+def devolver_conexoes_db(exc):
+    for conexao in g.pop('conexoes_db', []):
+        if conexao._conn is not None:
+            with _lock_pool_db:
+                conexao._estatisticas['devolvidas_no_teardown'] += 1
+            conexao.close()
+
+def _resumir_estatisticas_pool(estatisticas):
+    estatisticas['espera_total_ms'] = round(estatisticas['espera_total_ms'], 2)
+    estatisticas['espera_max_ms'] = round(estatisticas['espera_max_ms'], 2)
+    estatisticas['espera_media_ms'] = round(estatisticas['espera_total_ms'] / estatisticas['checkouts'], 2) if estatisticas['checkouts'] else 0.0
+    return estatisticas
+
+def estatisticas_pool_db():
+    """Tamanho, uso e tempos de espera do pool de conexões deste processo (e da réplica, se configurada)"""
+    with _lock_pool_db:
+        estatisticas = dict(_estatisticas_pools['primario'])
+        replica = {**_estatisticas_pools['replica'], **_estatisticas_replica}
+    resultado = {'minimo': DB_POOL_MIN, 'maximo': DB_POOL_MAX, 'espera_max_s': DB_POOL_ESPERA, 'pid': os.getpid(), **_resumir_estatisticas_pool(estatisticas)}
+    if DB_REPLICA_DSN:
+        resultado['replica'] = {
+            'janela_pos_escrita_s': DB_REPLICA_JANELA,
+            'pausada_por_s': round(max(_replica_pausada_ate['instante'] - time.monotonic(), 0), 1),
+            **_resumir_estatisticas_pool(replica)
+        }
+    return resultado
+
+# Linhas buscadas por vez nos cursores nomeados das listagens transmitidas em streaming
+STREAM_BLOCO = int(os.getenv('STREAM_BLOCO', '1000'))
+
+def resposta_json_streaming(query, params=None, formatar=dict):
+    """Lê a consulta por um cursor nomeado (no servidor) e transmite o array JSON em blocos, sem montar a lista em memória"""
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor(name=f'stream_{uuid.uuid4().hex}', cursor_factory=psycopg2.extras.DictCursor)
+        cur.execute(query, params)
+        # O primeiro bloco é lido antes da resposta, para que erros na consulta ainda virem um 500
+        primeiro_bloco = cur.fetchmany(STREAM_BLOCO)
+    except Exception:
+        conn.close()
+        raise
+    
+    def gerar():
+        try:
+            yield '['
+            bloco, separador = primeiro_bloco, ''
+            while bloco:
+                yield separador + ','.join(app.json.dumps(formatar(row)) for row in bloco)
+                bloco, separador = cur.fetchmany(STREAM_BLOCO), ','
+            yield ']'
+        finally:
+            # Devolver ao pool desfaz a transação do cursor nomeado e o encerra
+            conn.close()
+    
+    return Response(stream_with_context(gerar()), mimetype='application/json')
+
+def obter_sessao_reserva():
+    """Identificador da sessão de coleta dona das reservas de locais deste navegador"""
+    if 'sessao_reserva' not in session:
+        session['sessao_reserva'] = uuid.uuid4().hex
+    return session['sessao_reserva']
+
+# Arquivos de corte por (projeto, peca), compartilhados entre as requisições. As rotas de
+# /api/arquivos invalidam o cache; a validade limita a defasagem entre processos diferentes.
+ARQUIVOS_CACHE_TTL = int(os.getenv('ARQUIVOS_CACHE_TTL', '60'))
+_cache_arquivos = {'mapa': None, 'carregado_em': 0.0}
+_lock_arquivos = threading.Lock()
+
+def obter_arquivos_corte(conn):
+    """Mapa (projeto, peca) -> linhas de arquivos_pu ordenadas por camada, carregado em uma única consulta"""
+    with _lock_arquivos:
+        mapa = _cache_arquivos['mapa']
+        if mapa is not None and time.monotonic() - _cache_arquivos['carregado_em'] < ARQUIVOS_CACHE_TTL:
+            return mapa
+        
+        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.execute("SELECT * FROM public.arquivos_pu ORDER BY projeto, peca, camada")
+        mapa = {}
+        for row in cur.fetchall():
+            mapa.setdefault((row['projeto'], row['peca']), []).append(row)
+        cur.close()
+        
+        _cache_arquivos['mapa'] = mapa
+        _cache_arquivos['carregado_em'] = time.monotonic()
+        return mapa
+
+def invalidar_arquivos_corte():
+    """Descarta o mapa de arquivos de corte após qualquer alteração em arquivos_pu"""
+    with _lock_arquivos:
+        _cache_arquivos['mapa'] = None
 
 @app.route('/')
 def login():
@@ -248,6 +600,7 @@ def resetar_senha(user_id):
         )
         conn.commit()
         conn.close()
+        invalidar_usuario(user_id)
         
         return jsonify({'success': True, 'message': 'Senha resetada com sucesso!'})
     
@@ -278,6 +631,7 @@ def editar_usuario(user_id):
         )
         conn.commit()
         conn.close()
+        invalidar_usuario(user_id)
         
         return jsonify({'success': True, 'message': 'Usuário atualizado com sucesso!'})
     
@@ -297,6 +651,7 @@ def excluir_usuario(user_id):
         cur.execute("DELETE FROM public.users_pu WHERE id = %s", (user_id,))
         conn.commit()
         conn.close()
+        invalidar_usuario(user_id)
         
         return jsonify({'success': True, 'message': 'Usuário excluído com sucesso!'})
     
@@ -371,6 +726,13 @@ def relatorio():
 
 
 
+@app.route('/logs')
+@login_required
+def logs():
+    if current_user.setor != 'T.I' or current_user.role != 'admin':
+        return redirect(url_for('otimizadas'))
+    return render_template('logs.html')
+
 @app.route('/etiquetas')
 @login_required
 def etiquetas():
@@ -582,104 +944,19 @@ def desenhar_etiqueta_simples(c, x, y, width, height, dados):
         c.setFont("Courier", 8)
         c.drawString(x + 3*mm, y + 3*mm, codigo_barras_texto)
 
-def sugerir_local_armazenamento(tipo_peca, locais_ocupados, conn):
+def sugerir_local_armazenamento(tipo_peca, locais_ocupados, conn, indice=None):
     """Sugere local de armazenamento preenchendo horizontalmente E1, F1, G1..."""
     
     try:
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        # Sem índice pronto, carregar a ocupação atual (apenas duas consultas)
+        if indice is None:
+            indice = IndiceOcupacao.carregar(conn)
         
-        # Buscar locais ativos no banco
-        cur.execute("SELECT local, nome FROM public.pu_locais WHERE status = 'Ativo' ORDER BY local")
-        locais_ativos = cur.fetchall()
-        
-        if not locais_ativos:
+        if not indice.total_ativos:
             return 'E1', 'COLMEIA'
         
-        # Buscar locais que já têm peças diferentes do tipo atual
-        cur.execute("""
-            SELECT DISTINCT local FROM public.pu_inventory 
-            WHERE peca != %s AND local IS NOT NULL AND local != ''
-            UNION
-            SELECT DISTINCT local FROM public.pu_otimizadas 
-            WHERE peca != %s AND tipo = 'PU' AND local IS NOT NULL AND local != ''
-        """, (tipo_peca, tipo_peca))
-        locais_com_pecas_diferentes = {row['local'] for row in cur.fetchall()}
-        
-        # Criar mapeamento de locais por rack
-        locais_por_rack = {}
-        for local_info in locais_ativos:
-            local = local_info['local']
-            rack = local_info['nome']
-            if rack not in locais_por_rack:
-                locais_por_rack[rack] = []
-            locais_por_rack[rack].append(local)
-        
-        # Ordenar locais por número para cada rack
-        for rack in locais_por_rack:
-            locais_por_rack[rack].sort(key=lambda x: (int(''.join(filter(str.isdigit, x))), x[0]))
-        
-        # Sequência de preenchimento horizontal: E1, F1, G1... depois E2, F2, G2...
-        def gerar_sequencia_horizontal():
-            sequencia = []
-            
-            # Determinar range de números para cada rack
-            ranges_rack = {
-                'RACK1': range(1, 29),
-                'RACK2': range(29, 57), 
-                'RACK3': range(57, 85)
-            }
-            
-            # Para cada rack
-            for rack_name in ['RACK1', 'RACK2', 'RACK3']:
-                if rack_name not in locais_por_rack:
-                    continue
-                    
-                num_range = ranges_rack[rack_name]
-                
-                # Primeiro preencher todas as colunas E até M
-                for num in num_range:
-                    for letra_code in range(ord('E'), ord('M') + 1):
-                        letra = chr(letra_code)
-                        local = f"{letra}{num}"
-                        
-                        if local in locais_por_rack[rack_name]:
-                            sequencia.append((local, 'COLMEIA'))
-                
-                # Depois preencher D até A (só depois de terminar E-M)
-                for num in num_range:
-                    for letra_code in range(ord('D'), ord('A') - 1, -1):
-                        letra = chr(letra_code)
-                        local = f"{letra}{num}"
-                        
-                        if local in locais_por_rack[rack_name]:
-                            sequencia.append((local, 'COLMEIA'))
-            
-            return sequencia
-        
-        sequencia_completa = gerar_sequencia_horizontal()
-        
-        # Combinar locais ocupados com locais que têm peças diferentes
-        locais_bloqueados = locais_ocupados | locais_com_pecas_diferentes
-        
-        # Buscar primeiro local disponível
-        for local, rack in sequencia_completa:
-            if local not in locais_bloqueados:
-                # Verificar novamente se o local não foi ocupado por outra thread/processo
-                cur.execute("""
-                    SELECT COUNT(*) FROM (
-                        SELECT local FROM public.pu_inventory WHERE local = %s
-                        UNION ALL
-                        SELECT local FROM public.pu_otimizadas WHERE local = %s AND tipo = 'PU'
-                        UNION ALL
-                        SELECT local FROM public.pu_manuais WHERE local = %s
-                    ) AS occupied
-                """, (local, local, local))
-                
-                if cur.fetchone()[0] == 0:
-                    return local, rack
-        
-        # Se não encontrou nenhum disponível, retornar None para indicar erro
-        return None, None
+        # Se não encontrou nenhum disponível, retorna (None, None) para indicar erro
+        return indice.sugerir(tipo_peca, locais_ocupados)
         
     except Exception as e:
         print(f"DEBUG: Erro na sugestão de local: {e}")
@@ -701,62 +978,17 @@ def adicionar_peca_manual():
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         
-        # Criar tabela se não existir
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS public.pu_manuais (
-                id SERIAL PRIMARY KEY,
-                op TEXT,
-                peca TEXT,
-                projeto TEXT,
-                veiculo TEXT,
-                local TEXT,
-                rack TEXT,
-                arquivo TEXT,
-                usuario TEXT,
-                data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        # Buscar TODOS os locais ocupados (incluindo manuais)
-        cur.execute("""
-            SELECT local FROM public.pu_inventory WHERE local IS NOT NULL AND local != '' 
-            UNION 
-            SELECT local FROM public.pu_otimizadas WHERE tipo = 'PU' AND local IS NOT NULL AND local != ''
-            UNION
-            SELECT local FROM public.pu_manuais WHERE local IS NOT NULL AND local != ''
-        """)
-        locais_ocupados = {row['local'] for row in cur.fetchall()}
-        
-        # Buscar locais que já têm peças diferentes do tipo atual
-        cur.execute("""
-            SELECT DISTINCT local FROM public.pu_inventory 
-            WHERE peca != %s AND local IS NOT NULL AND local != ''
-            UNION
-            SELECT DISTINCT local FROM public.pu_otimizadas 
-            WHERE peca != %s AND tipo = 'PU' AND local IS NOT NULL AND local != ''
-            UNION
-            SELECT DISTINCT local FROM public.pu_manuais 
-            WHERE peca != %s AND local IS NOT NULL AND local != ''
-        """, (peca, peca, peca))
-        locais_com_pecas_diferentes = {row['local'] for row in cur.fetchall()}
-        
-        # Combinar todos os locais bloqueados
-        locais_bloqueados = locais_ocupados | locais_com_pecas_diferentes
-        
         # Verificar se existe arquivo
-        cur.execute("""
-            SELECT COUNT(*) FROM public.arquivos_pu
-            WHERE projeto = %s AND peca = %s
-        """, (projeto, peca))
-        
-        tem_arquivo = cur.fetchone()[0] > 0
+        tem_arquivo = (projeto, peca) in obter_arquivos_corte(conn)
         arquivo_status = "Arquivo encontrado" if tem_arquivo else "Sem arquivo"
         
-        # Sugerir local (passando locais bloqueados)
-        local_sugerido, rack_sugerido = sugerir_local_armazenamento(peca, locais_bloqueados, conn)
+        # Sugerir local pelo mesmo alocador em lote usado na coleta (ocupação inclui manuais)
+        indice = IndiceOcupacao.carregar(conn)
+        alocacao = alocar_lote(indice, [{'op': op, 'peca': peca, 'projeto': projeto}])[0]
+        local_sugerido, rack_sugerido = alocacao['local'], alocacao['rack']
         
         # Verificar se conseguiu sugerir um local válido
-        if not local_sugerido or not rack_sugerido:
+        if local_sugerido == 'SEM LOCAL':
             conn.close()
             return jsonify({'success': False, 'message': 'Não há locais disponíveis para esta peça'}), 400
         
@@ -796,68 +1028,185 @@ def adicionar_peca_manual():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro: {str(e)}'}), 500
 
+@app.route('/api/alocar-lote', methods=['POST'])
+@login_required
+def api_alocar_lote():
+    """Sugere locais para várias peças de uma vez, sem gravar nada"""
+    dados = request.get_json() or {}
+    pecas = dados.get('pecas', [])
+    
+    if not pecas:
+        return jsonify({'success': False, 'message': 'Nenhuma peça informada'})
+    
+    try:
+        conn = get_db_connection()
+        indice = IndiceOcupacao.carregar(conn)
+        
+        pecas = [{
+            'op': str(peca.get('op', '')).strip(),
+            'peca': str(peca.get('peca', '')).strip(),
+            'projeto': str(peca.get('projeto', '')).strip()
+        } for peca in pecas]
+        
+        # Com "reservar", os locais ficam presos para esta sessão até a otimização ou o fim do TTL
+        if dados.get('reservar'):
+            alocacoes = alocar_e_reservar(conn, indice, pecas, obter_sessao_reserva(), current_user.username)
+        else:
+            alocacoes = alocar_lote(indice, pecas)
+        conn.close()
+        
+        sem_local = sum(1 for alocacao in alocacoes if alocacao['local'] == 'SEM LOCAL')
+        
+        return jsonify({
+            'success': True,
+            'alocacoes': alocacoes,
+            'total': len(alocacoes),
+            'sem_local': sem_local
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Erro: {str(e)}'}), 500
+
+@app.route('/api/simular-capacidade', methods=['POST'])
+@login_required
+def api_simular_capacidade():
+    """Verifica quantas das peças propostas cabem nos racks, sem gravar nada nem reservar locais"""
+    dados = request.get_json() or {}
+    pecas = dados.get('pecas', [])
+    
+    if not pecas:
+        return jsonify({'success': False, 'message': 'Nenhuma peça informada'})
+    
+    try:
+        conn = get_db_connection()
+        # As reservas da própria sessão são das peças que ela coletou e provavelmente está simulando
+        indice = IndiceOcupacao.carregar(conn, excluir_sessao=session.get('sessao_reserva'))
+        conn.close()
+        
+        resultado = simular_capacidade(indice, [{
+            'op': str(peca.get('op', '')).strip(),
+            'peca': str(peca.get('peca', '')).strip(),
+            'projeto': str(peca.get('projeto', '')).strip()
+        } for peca in pecas])
+        
+        return jsonify({'success': True, **resultado})
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Erro: {str(e)}'}), 500
+
+@app.route('/api/pool-db')
+@login_required
+def api_pool_db():
+    """Estatísticas do pool de conexões deste processo, para ajustar DB_POOL_MAX e DB_POOL_ESPERA"""
+    return jsonify(estatisticas_pool_db())
+
 @app.route('/api/atualizar-apontamentos', methods=['POST'])
 @login_required
 def api_atualizar_apontamentos():
+    """Agenda a sincronização com o pplug em segundo plano; cliques repetidos reaproveitam o job em andamento"""
     try:
-        resultado = atualizar_apontamentos()
-        return jsonify(resultado)
+        job_id, criado = iniciar_job(conexao_db, 'atualizar_apontamentos', current_user.username, atualizar_apontamentos)
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'ja_em_andamento': not criado,
+            'status_url': url_for('api_job', job_id=job_id)
+        }), 202
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro ao atualizar apontamentos: {str(e)}'}), 500
 
+@app.route('/api/jobs/<job_id>')
+@login_required
+def api_job(job_id):
+    """Situação de um job em segundo plano: status, etapa, contagens de linhas e duração"""
+    try:
+        with conexao_db() as conn:
+            job = obter_job(conn, job_id)
+        if job is None:
+            return jsonify({'error': 'Job não encontrado'}), 404
+        return jsonify(job)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Folga aplicada ao watermark de coleta: transações abertas antes da coleta gravam um
+# CURRENT_TIMESTAMP anterior a ela e só ficam visíveis depois
+MARGEM_COLETA_INCREMENTAL = timedelta(minutes=5)
+
+def montar_item_dados(row, alocacao, pecas_com_arquivo):
+    """Monta o item da tela de apontamentos para uma peça pendente já alocada"""
+    tem_arquivo = (str(row['projeto']) if row['projeto'] else '', row['peca']) in pecas_com_arquivo
+    return {
+        'op_pai': '0',
+        'op': str(row['op']) if row['op'] else '',
+        'peca': str(row['peca']) if row['peca'] else '',
+        'projeto': str(row['projeto']) if row['projeto'] else '',
+        'veiculo': str(row['veiculo']) if row['veiculo'] else '',
+        'local': alocacao['local'],
+        'rack': alocacao['rack'],
+        'data_criacao': row['data'].isoformat() if row['data'] else '',
+        'arquivo_status': 'Arquivo encontrado' if tem_arquivo else 'Sem arquivo de corte'
+    }
+
 @app.route('/api/dados')
 def api_dados():
     data_inicio = request.args.get('data_inicio')
     data_fim = request.args.get('data_fim')
     etapa = request.args.get('etapa', 'FILA')
     
-    print(f"DEBUG: Buscando dados - etapa: {etapa}, data_inicio: {data_inicio}, data_fim: {data_fim}")
+    # Modo incremental: o cliente informa o watermark da última coleta (maior id e instante da coleta)
+    desde_id = request.args.get('desde_id', type=int)
+    coletado_desde = request.args.get('coletado_em')
+    incremental = desde_id is not None and bool(coletado_desde)
+    
+    if incremental:
+        try:
+            limite = datetime.fromisoformat(coletado_desde) - MARGEM_COLETA_INCREMENTAL
+        except ValueError:
+            return jsonify({'error': 'Watermark de coleta inválido'}), 400
+    
+    print(f"DEBUG: Buscando dados - etapa: {etapa}, data_inicio: {data_inicio}, data_fim: {data_fim}, desde_id: {desde_id}")
     
     try:
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         
-        # Verificar se a tabela existe
-        cur.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_schema = 'public' 
-                AND table_name = 'apontamento_pplug_jarinu'
-            )
-        """)
-        tabela_existe = cur.fetchone()[0]
+        # A tabela de apontamentos é alimentada por fora e pode não existir ainda (to_regclass não consulta o catálogo inteiro).
+        # Junto, o instante desta coleta no relógio do banco (mesma base dos CURRENT_TIMESTAMP gravados)
+        cur.execute("SELECT to_regclass('public.apontamento_pplug_jarinu') IS NOT NULL, LOCALTIMESTAMP")
+        tabela_existe, coletado_em = cur.fetchone()
         
         if not tabela_existe:
             print("DEBUG: Tabela apontamento_pplug_jarinu não existe")
             conn.close()
             return jsonify([])
         
-        # Buscar peças já existentes no estoque e otimizadas
-        cur.execute("SELECT op, peca FROM public.pu_inventory")
-        pecas_estoque = cur.fetchall()
-        
-        cur.execute("SELECT op, peca FROM public.pu_otimizadas WHERE tipo = 'PU'")
-        pecas_otimizadas = cur.fetchall()
+        sessao = obter_sessao_reserva()
+        removidos = []
         
-        # Buscar TODOS os locais ocupados (incluindo os já otimizados)
-        cur.execute("SELECT local FROM public.pu_inventory WHERE local IS NOT NULL AND local != '' UNION SELECT local FROM public.pu_otimizadas WHERE tipo = 'PU' AND local IS NOT NULL AND local != ''")
-        locais_ocupados_fixos = {row['local'] for row in cur.fetchall()}
-        
-        # Verificar se há locais disponíveis
-        cur.execute("SELECT COUNT(*) FROM public.pu_locais WHERE status = 'Ativo'")
-        total_locais = cur.fetchone()[0]
-        
-        if len(locais_ocupados_fixos) >= total_locais:
-            conn.close()
-            return jsonify({'error': 'Não há locais disponíveis. Todos os locais estão ocupados.'}), 400
-        
-        # Criar set para busca rápida
-        pecas_existentes = {f"{row['op']}_{row['peca']}" for row in pecas_estoque}
-        pecas_existentes.update({f"{row['op']}_{row['peca']}" for row in pecas_otimizadas})
+        if incremental:
+            # Peças que saíram do estado pendente desde a última coleta
+            cur.execute("""
+                SELECT op, peca FROM public.pu_inventory WHERE data >= %s
+                UNION
+                SELECT op, peca FROM public.pu_otimizadas WHERE tipo = 'PU' AND data_otimizacao >= %s
+            """, (limite, limite))
+            removidos = [{'op': str(row['op'] or ''), 'peca': str(row['peca'] or '')} for row in cur.fetchall()]
+            
+            # Liberar as reservas desta sessão que pertenciam às peças removidas
+            if removidos:
+                cur.execute("""
+                    DELETE FROM public.pu_reservas
+                    WHERE sessao = %s AND (op, peca) IN (SELECT * FROM unnest(%s::text[], %s::text[]))
+                """, (sessao, [r['op'] for r in removidos], [r['peca'] for r in removidos]))
+                conn.commit()
+        else:
+            # Nova coleta completa substitui as reservas anteriores desta sessão
+            cur.execute("DELETE FROM public.pu_reservas WHERE sessao = %s", (sessao,))
+            conn.commit()
         
         # Construir query com filtros de data e etapa
         query = """
-            SELECT op, item as peca, projeto, veiculo, data
+            SELECT id, op, item as peca, projeto, veiculo, data
             FROM public.apontamento_pplug_jarinu 
             WHERE UPPER(etapa) = UPPER(%s)
         """
@@ -871,6 +1220,10 @@ def api_dados():
             query += " AND data <= %s"
             params.append(data_fim)
         
+        if incremental:
+            query += " AND id > %s"
+            params.append(desde_id)
+        
         query += " ORDER BY data DESC"
         
         print(f"DEBUG: Query: {query}")
@@ -881,57 +1234,66 @@ def api_dados():
         
         print(f"DEBUG: Encontrados {len(dados_banco)} registros no banco")
         
+        ids = [row['id'] for row in dados_banco if row['id'] is not None]
+        watermark = {
+            'id': max(ids + ([desde_id] if incremental else []), default=0),
+            'coletado_em': coletado_em.isoformat()
+        }
+        
+        # Buscar apenas as peças do intervalo que já estão no estoque ou nas otimizadas
+        ops = list({str(row['op']) for row in dados_banco if row['op'] is not None})
+        cur.execute("""
+            SELECT op, peca FROM public.pu_inventory WHERE op::text = ANY(%s)
+            UNION
+            SELECT op, peca FROM public.pu_otimizadas WHERE tipo = 'PU' AND op::text = ANY(%s)
+        """, (ops, ops))
+        pecas_existentes = {f"{row['op']}_{row['peca']}" for row in cur.fetchall()}
+        
+        # No modo incremental, peças que esta sessão já tem reservadas continuam na tela do cliente
+        if incremental:
+            cur.execute("SELECT op, peca FROM public.pu_reservas WHERE sessao = %s", (sessao,))
+            pecas_existentes.update(f"{row['op']}_{row['peca']}" for row in cur.fetchall())
+        
+        # Separar as peças pendentes (ainda não estão no estoque nem nas otimizadas)
+        pendentes = [row for row in dados_banco if f"{row['op']}_{row['peca']}" not in pecas_existentes]
+        
+        # Carregar uma única vez a ordem de preenchimento e a ocupação atual (incluindo os já otimizados e reservados)
+        indice = IndiceOcupacao.carregar(conn)
+        
+        # Verificar se há locais disponíveis
+        if not incremental and indice.locais_livres() == 0:
+            conn.close()
+            return jsonify({'error': 'Não há locais disponíveis. Todos os locais estão ocupados.'}), 400
+        
+        # Peças com arquivo de corte, do mapa compartilhado entre as requisições
+        pecas_com_arquivo = obter_arquivos_corte(conn)
+        
+        # Alocar todas as peças pendentes em uma única passada e reservar os locais para esta sessão
+        alocacoes = alocar_e_reservar(
+            conn, indice,
+            [{'op': row['op'], 'peca': row['peca'], 'projeto': row['projeto']} for row in pendentes],
+            sessao, getattr(current_user, 'username', None)
+        )
+        
         # Processar dados do banco
         dados_filtrados = []
-        locais_usados_nesta_sessao = set()
         
-        for row in dados_banco:
+        for row, alocacao in zip(pendentes, alocacoes):
             try:
-                chave_peca = f"{row['op']}_{row['peca']}"
-                if chave_peca not in pecas_existentes:
-                    # Combinar locais ocupados com os já usados nesta sessão
-                    locais_bloqueados = locais_ocupados_fixos | locais_usados_nesta_sessao
-                    
-                    # Aplicar lógica de sugestão
-                    local_sugerido, rack_sugerido = sugerir_local_armazenamento(row['peca'], locais_bloqueados, conn)
-                    
-                    # Se não conseguiu sugerir local, usar "SEM LOCAL"
-                    if not local_sugerido or not rack_sugerido or local_sugerido in locais_usados_nesta_sessao:
-                        local_sugerido = "SEM LOCAL"
-                        rack_sugerido = "N/A"
-                        print(f"DEBUG: Não foi possível sugerir local para peça {row['peca']}, usando SEM LOCAL")
-                    
-                    # Verificar se existe arquivo de corte
-                    cur.execute("""
-                        SELECT COUNT(*) FROM public.arquivos_pu
-                        WHERE projeto = %s AND peca = %s
-                    """, (str(row['projeto']) if row['projeto'] else '', row['peca']))
-                    
-                    tem_arquivo = cur.fetchone()[0] > 0
-                    arquivo_status = 'Arquivo encontrado' if tem_arquivo else 'Sem arquivo de corte'
-                    
-                    item = {
-                        'op_pai': '0',
-                        'op': str(row['op']) if row['op'] else '',
-                        'peca': str(row['peca']) if row['peca'] else '',
-                        'projeto': str(row['projeto']) if row['projeto'] else '',
-                        'veiculo': str(row['veiculo']) if row['veiculo'] else '',
-                        'local': local_sugerido or '',
-                        'rack': rack_sugerido or '',
-                        'data_criacao': row['data'].isoformat() if row['data'] else '',
-                        'arquivo_status': arquivo_status
-                    }
-                    
-                    # Adicionar o local aos usados nesta sessão (apenas se não for "SEM LOCAL")
-                    if local_sugerido and local_sugerido != "SEM LOCAL":
-                        locais_usados_nesta_sessao.add(local_sugerido)
-                    dados_filtrados.append(item)
+                if alocacao['local'] == 'SEM LOCAL':
+                    print(f"DEBUG: Não foi possível sugerir local para peça {row['peca']}, usando SEM LOCAL")
+                dados_filtrados.append(montar_item_dados(row, alocacao, pecas_com_arquivo))
             except Exception as row_error:
                 print(f"DEBUG: Erro ao processar linha: {row_error}")
                 continue
         
-        # Adicionar peças manuais
-        cur.execute("SELECT op, peca, projeto, veiculo, local, rack, arquivo FROM public.pu_manuais")
+        # Adicionar peças manuais (no modo incremental, só as criadas desde a última coleta)
+        query_manuais = "SELECT op, peca, projeto, veiculo, local, rack, arquivo FROM public.pu_manuais"
+        params_manuais = []
+        if incremental:
+            query_manuais += " WHERE data_criacao >= %s"
+            params_manuais.append(limite)
+        cur.execute(query_manuais, params_manuais)
         pecas_manuais = cur.fetchall()
         
         for peca_manual in pecas_manuais:
@@ -949,8 +1311,18 @@ def api_dados():
             dados_filtrados.append(item)
         
         conn.close()
+        
+        if incremental:
+            print(f"DEBUG: Coleta incremental - {len(dados_filtrados)} novos, {len(removidos)} removidos")
+            return jsonify({'novos': dados_filtrados, 'removidos': removidos, 'watermark': watermark})
+        
         print(f"DEBUG: Retornando {len(dados_filtrados)} itens filtrados (incluindo {len(pecas_manuais)} manuais)")
-        return jsonify(dados_filtrados)
+        
+        # A coleta completa continua devolvendo a lista; o watermark segue nos cabeçalhos
+        resposta = jsonify(dados_filtrados)
+        resposta.headers['X-Watermark-Id'] = str(watermark['id'])
+        resposta.headers['X-Coletado-Em'] = watermark['coletado_em']
+        return resposta
         
     except Exception as e:
         print(f"DEBUG: Erro na API dados: {str(e)}")
@@ -959,33 +1331,13 @@ def api_dados():
         return jsonify({'error': f'Erro ao buscar dados: {str(e)}'}), 500
 
 @app.route('/api/estoque')
+@leitura_replica
 def api_estoque():
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
-        # Verificar se tabela existe
-        cur.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_schema = 'public' 
-                AND table_name = 'pu_inventory'
-            )
-        """)
-        tabela_existe = cur.fetchone()[0]
-        
-        if not tabela_existe:
-            conn.close()
-            return jsonify([])
-        
         # Buscar todos os dados
-        cur.execute("SELECT id, op_pai, op, peca, projeto, veiculo, local, rack, camada FROM public.pu_inventory ORDER BY id DESC")
-        dados = cur.fetchall()
-        conn.close()
-        
-        resultado = []
-        for row in dados:
-            resultado.append({
+        return resposta_json_streaming(
+            "SELECT id, op_pai, op, peca, projeto, veiculo, local, rack, camada FROM public.pu_inventory ORDER BY id DESC",
+            formatar=lambda row: {
                 'id': row['id'],
                 'op_pai': row['op_pai'] or '',
                 'op': row['op'] or '',
@@ -995,39 +1347,18 @@ def api_estoque():
                 'local': row['local'] or '',
                 'rack': row['rack'] or '',
                 'camada': row['camada'] or ''
-            })
-        
-        print(f"DEBUG: Retornando {len(resultado)} itens do estoque")
-        return jsonify(resultado)
+            }
+        )
         
     except Exception as e:
         print(f"ERRO na API estoque: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/estoque-data')
+@leitura_replica
 def estoque_data():
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
-        # Verificar se tabela existe
-        cur.execute("""
-            SELECT EXISTS (
-                SELECT FROM information_schema.tables 
-                WHERE table_schema = 'public' 
-                AND table_name = 'pu_inventory'
-            )
-        """)
-        tabela_existe = cur.fetchone()[0]
-        
-        if not tabela_existe:
-            conn.close()
-            return jsonify([])
-        
-        cur.execute("SELECT id, op_pai, op, peca, projeto, veiculo, local, rack, camada FROM public.pu_inventory ORDER BY id DESC")
-        dados = cur.fetchall()
-        conn.close()
-        return jsonify([dict(row) for row in dados])
+        return resposta_json_streaming("SELECT id, op_pai, op, peca, projeto, veiculo, local, rack, camada FROM public.pu_inventory ORDER BY id DESC")
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1036,9 +1367,7 @@ def estoque_data():
 def otimizar_pecas():
     conn = None
     try:
-        print("DEBUG: Iniciando otimização")
-        dados = request.get_json()
-        print(f"DEBUG: Dados recebidos: {dados}")
+        dados = request.get_json() or {}
         
         pecas_selecionadas = dados.get('pecas', [])
         print(f"DEBUG: {len(pecas_selecionadas)} peças selecionadas")
@@ -1046,14 +1375,18 @@ def otimizar_pecas():
         if not pecas_selecionadas:
             return jsonify({'success': False, 'message': 'Nenhuma peça selecionada'})
         
-        # Verificar se há locais duplicados nas peças selecionadas (excluindo "SEM LOCAL")
-        locais_selecionados = [peca.get('local') for peca in pecas_selecionadas if peca.get('local') and peca.get('local') != 'SEM LOCAL']
-        locais_duplicados = [local for local in set(locais_selecionados) if locais_selecionados.count(local) > 1]
+        # Agrupar as peças por local (excluindo "SEM LOCAL"); cada local recebe um único tipo de peça
+        pecas_por_local = {}
+        for peca in pecas_selecionadas:
+            local = peca.get('local')
+            if local and local != 'SEM LOCAL':
+                pecas_por_local.setdefault(local, []).append(peca.get('peca', ''))
         
-        if locais_duplicados:
+        locais_tipos_diferentes = [local for local, tipos in pecas_por_local.items() if len(set(tipos)) > 1]
+        if locais_tipos_diferentes:
             return jsonify({
                 'success': False, 
-                'message': f'Locais duplicados detectados: {", ".join(locais_duplicados)}. Não é possível otimizar peças com o mesmo local.'
+                'message': f'Locais com tipos de peça diferentes detectados: {", ".join(locais_tipos_diferentes)}. Cada local recebe um único tipo de peça.'
             })
         
         # Verificar se há peças sem local disponível
@@ -1064,63 +1397,97 @@ def otimizar_pecas():
                 'message': f'Existem {len(pecas_sem_local)} peça(s) sem local disponível. Não é possível otimizar.'
             })
         
-        print("DEBUG: Conectando ao banco")
         conn = get_db_connection()
         cur = conn.cursor()
         
-        # Verificar se os locais das peças selecionadas já estão ocupados no banco
-        for peca in pecas_selecionadas:
-            local = peca.get('local')
-            if local:
-                cur.execute("""
-                    SELECT COUNT(*) FROM (
-                        SELECT local FROM public.pu_inventory WHERE local = %s
-                        UNION ALL
-                        SELECT local FROM public.pu_otimizadas WHERE local = %s AND tipo = 'PU'
-                    ) AS occupied
-                """, (local, local))
-                
-                if cur.fetchone()[0] > 0:
-                    conn.close()
-                    return jsonify({
-                        'success': False, 
-                        'message': f'Local {local} já está ocupado no banco de dados. Atualize os dados antes de otimizar.'
-                    })
-        
-        print("DEBUG: Criando tabela se necessário")
+        # Locais cujas peças estão todas cobertas por reservas desta sessão, para o mesmo tipo de peça,
+        # já estão garantidos e dispensam nova verificação
+        locais_otimizados = list(pecas_por_local)
         cur.execute("""
-            CREATE TABLE IF NOT EXISTS public.pu_otimizadas (
-                id SERIAL PRIMARY KEY,
-                op_pai TEXT,
-                op TEXT,
-                peca TEXT,
-                projeto TEXT,
-                veiculo TEXT,
-                local TEXT,
-                rack TEXT,
-                cortada BOOLEAN DEFAULT FALSE,
-                user_otimizacao TEXT,
-                data_otimizacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                tipo TEXT DEFAULT 'PU',
-                camada TEXT
-            )
-        """)
-        conn.commit()
-        print("DEBUG: Tabela criada/verificada")
-        
-        total_inseridas = 0
-        
-        print("DEBUG: Iniciando inserções")
-        for i, peca in enumerate(pecas_selecionadas):
-            print(f"DEBUG: Inserindo peça {i+1}: {peca}")
+            SELECT local, COUNT(*) FROM public.pu_reservas
+            WHERE sessao = %s AND expira_em > NOW()
+            AND (local, peca) IN (SELECT * FROM unnest(%s::text[], %s::text[]))
+            GROUP BY local
+        """, (session.get('sessao_reserva'), locais_otimizados, [pecas_por_local[local][0] for local in locais_otimizados]))
+        reservas_por_local = dict(cur.fetchall())
+        locais_reservados = {local for local, tipos in pecas_por_local.items() if reservas_por_local.get(local, 0) >= len(tipos)}
+        
+        # Verificar capacidade e tipo de peça dos demais locais no banco, todos em uma consulta
+        locais_verificar = [local for local in pecas_por_local if local not in locais_reservados]
+        situacao_locais, locais_travados = {}, set()
+        if locais_verificar:
+            # Travar os locais até o commit, como em reservar_locais: outra sessão não reserva o mesmo espaço
+            # entre a verificação e a gravação; locais que outra sessão está reservando agora são recusados
+            cur.execute("""
+                SELECT local FROM public.pu_locais WHERE local = ANY(%s)
+                FOR UPDATE SKIP LOCKED
+            """, (locais_verificar,))
+            locais_travados = {row[0] for row in cur.fetchall()}
             
-            # Buscar camadas da peça na tabela pu_camadas
+            # Reservas vivas de outras sessões ocupam o local como peças já gravadas
             cur.execute("""
-                SELECT l1, l3 FROM public.pu_camadas
-                WHERE projeto = %s AND peca = %s
-            """, (peca.get('projeto', ''), peca.get('peca', '')))
+                SELECT alvo.local, cap.local IS NOT NULL, COALESCE(cap.capacidade, 1),
+                       COALESCE(ocup.ocupacao, 0) + COALESCE(res.reservadas, 0),
+                       COALESCE(ocup.outro_tipo, FALSE) OR COALESCE(res.outro_tipo, FALSE)
+                FROM unnest(%(locais)s::text[], %(pecas)s::text[]) AS alvo(local, peca)
+                LEFT JOIN (
+                    SELECT local, MAX(capacidade) AS capacidade FROM public.pu_locais
+                    WHERE local = ANY(%(locais)s) GROUP BY local
+                ) AS cap ON cap.local = alvo.local
+                LEFT JOIN LATERAL (
+                    SELECT SUM(estoque + otimizadas) AS ocupacao,
+                           BOOL_OR(peca <> alvo.peca AND estoque + otimizadas > 0) AS outro_tipo
+                    FROM public.pu_ocupacao WHERE local = alvo.local
+                ) AS ocup ON TRUE
+                LEFT JOIN LATERAL (
+                    SELECT COUNT(*) AS reservadas, BOOL_OR(peca IS DISTINCT FROM alvo.peca) AS outro_tipo
+                    FROM public.pu_reservas
+                    WHERE local = alvo.local AND sessao IS DISTINCT FROM %(sessao)s AND expira_em > NOW()
+                ) AS res ON TRUE
+            """, {
+                'locais': locais_verificar,
+                'pecas': [pecas_por_local[local][0] for local in locais_verificar],
+                'sessao': session.get('sessao_reserva')
+            })
+            situacao_locais = {row[0]: tuple(row[1:]) for row in cur.fetchall()}
+        
+        for local in locais_verificar:
+            cadastrado, capacidade, ocupacao, outro_tipo = situacao_locais[local]
+            quantidade = len(pecas_por_local[local])
+            
+            if cadastrado and local not in locais_travados:
+                conn.close()
+                return jsonify({
+                    'success': False, 
+                    'message': f'Local {local} está sendo reservado por outra sessão. Atualize os dados antes de otimizar.'
+                })
             
-            camadas_result = cur.fetchone()
+            if outro_tipo or ocupacao >= capacidade:
+                conn.close()
+                return jsonify({
+                    'success': False, 
+                    'message': f'Local {local} já está ocupado no banco de dados. Atualize os dados antes de otimizar.'
+                })
+            
+            if ocupacao + quantidade > capacidade:
+                conn.close()
+                return jsonify({
+                    'success': False, 
+                    'message': f'Local {local} comporta apenas {capacidade - ocupacao} peça(s) a mais. Não é possível otimizar {quantidade} peças nesse local.'
+                })
+        
+        # Camadas de todas as peças selecionadas em uma única consulta
+        pares = list({(peca.get('projeto', ''), peca.get('peca', '')) for peca in pecas_selecionadas})
+        cur.execute("""
+            SELECT DISTINCT ON (projeto, peca) projeto, peca, l1, l3 FROM public.pu_camadas
+            WHERE (projeto, peca) IN (SELECT * FROM unnest(%s::text[], %s::text[]))
+            ORDER BY projeto, peca
+        """, ([projeto for projeto, _ in pares], [peca for _, peca in pares]))
+        camadas_por_peca = {(projeto, peca): (l1, l3) for projeto, peca, l1, l3 in cur.fetchall()}
+        
+        linhas_otimizadas = []
+        for peca in pecas_selecionadas:
+            camadas_result = camadas_por_peca.get((peca.get('projeto', ''), peca.get('peca', '')))
             camadas_para_inserir = []
             
             if camadas_result:
@@ -1149,12 +1516,9 @@ def otimizar_pecas():
             if not camadas_para_inserir:
                 camadas_para_inserir = [None]
             
-            # Inserir uma linha para cada camada
+            # Uma linha para cada camada
             for camada in camadas_para_inserir:
-                cur.execute("""
-                    INSERT INTO public.pu_otimizadas (op_pai, op, peca, projeto, veiculo, local, rack, user_otimizacao, tipo, camada)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 'PU', %s)
-                """, (
+                linhas_otimizadas.append((
                     peca.get('op_pai', ''),
                     peca.get('op', ''),
                     peca.get('peca', ''),
@@ -1165,19 +1529,26 @@ def otimizar_pecas():
                     current_user.username,
                     camada
                 ))
-                total_inseridas += 1
-            
-            print(f"DEBUG: Peça {i+1} inserida com {len(camadas_para_inserir)} camada(s)")
         
-        print("DEBUG: Fazendo commit")
-        conn.commit()
+        # Todas as linhas de camada em uma inserção em lote
+        psycopg2.extras.execute_values(cur, """
+            INSERT INTO public.pu_otimizadas (op_pai, op, peca, projeto, veiculo, local, rack, user_otimizacao, tipo, camada)
+            VALUES %s
+        """, linhas_otimizadas, template="(%s, %s, %s, %s, %s, %s, %s, %s, 'PU', %s)", page_size=1000)
+        total_inseridas = len(linhas_otimizadas)
+        print(f"DEBUG: {len(pecas_selecionadas)} peça(s) otimizada(s) em {total_inseridas} linha(s)")
+        
+        # Consumir as reservas da sessão em todos os locais otimizados, cobertos ou não, para não contarem
+        # de novo sobre as linhas recém-gravadas em pu_otimizadas
+        cur.execute("""
+            DELETE FROM public.pu_reservas WHERE sessao = %s AND local = ANY(%s)
+        """, (session.get('sessao_reserva'), locais_otimizados))
         
         # Limpar peças manuais após otimização
         cur.execute("DELETE FROM public.pu_manuais")
         conn.commit()
         
         conn.close()
-        print("DEBUG: Sucesso!")
         
         return jsonify({
             'success': True, 
@@ -1198,27 +1569,21 @@ def otimizar_pecas():
 
 @app.route('/api/otimizadas')
 @login_required
+@leitura_replica
 def api_otimizadas():
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute("""
-            SELECT id, op_pai, op, peca, projeto, veiculo, local, rack, cortada, user_otimizacao, data_otimizacao, camada 
-            FROM public.pu_otimizadas 
-            WHERE tipo = 'PU'
-            ORDER BY id DESC
-        """)
-        dados = cur.fetchall()
-        conn.close()
-        
-        resultado = []
-        for row in dados:
+        def formatar(row):
             item = dict(row)
             if item['data_otimizacao']:
                 item['data_otimizacao'] = item['data_otimizacao'].isoformat()
-            resultado.append(item)
+            return item
         
-        return jsonify(resultado)
+        return resposta_json_streaming("""
+            SELECT id, op_pai, op, peca, projeto, veiculo, local, rack, cortada, user_otimizacao, data_otimizacao, camada 
+            FROM public.pu_otimizadas 
+            WHERE tipo = 'PU'
+            ORDER BY id DESC
+        """, formatar=formatar)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1289,52 +1654,30 @@ def enviar_estoque():
         if not ids:
             return jsonify({'success': False, 'message': 'Nenhuma peça selecionada'})
         
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        ids = [int(id_peca) for id_peca in ids]
         
-        # Buscar peças selecionadas
-        placeholders = ','.join(['%s'] * len(ids))
-        cur.execute(f"""
-            SELECT * FROM public.pu_otimizadas 
-            WHERE id IN ({placeholders}) AND tipo = 'PU'
-        """, ids)
-        pecas = cur.fetchall()
+        conn = get_db_connection()
+        cur = conn.cursor()
         
-        # Inserir no estoque e no controle
-        for peca in pecas:
-            # Inserir no estoque
-            cur.execute("""
+        # Mover em uma única instrução: as linhas removidas das otimizadas alimentam o estoque e o controle
+        cur.execute("""
+            WITH movidas AS (
+                DELETE FROM public.pu_otimizadas
+                WHERE id = ANY(%(ids)s) AND tipo = 'PU'
+                RETURNING op_pai, op, peca, projeto, veiculo, local, rack, camada
+            ), estoque AS (
                 INSERT INTO public.pu_inventory (op_pai, op, peca, projeto, veiculo, local, rack, data, usuario, camada)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP, %s, %s)
-            """, (
-                peca['op_pai'],
-                peca['op'],
-                peca['peca'],
-                peca['projeto'],
-                peca['veiculo'],
-                peca['local'],
-                peca['rack'],
-                current_user.username,
-                peca.get('camada')
-            ))
-            
-            # Inserir no controle
-            cur.execute("""
+                SELECT op_pai, op, peca, projeto, veiculo, local, rack, CURRENT_TIMESTAMP, %(usuario)s, camada
+                FROM movidas
+            ), controle AS (
+                -- cortada = true quando enviado para estoque
                 INSERT INTO public.pu_controle (op_pai, op, peca, projeto, veiculo, local, rack, cortada, user_otimizacao, tipo, camada)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                peca['op_pai'],
-                peca['op'],
-                peca['peca'],
-                peca['projeto'],
-                peca['veiculo'],
-                peca['local'],
-                peca['rack'],
-                True,  # cortada = true quando enviado para estoque
-                current_user.username,
-                'PU',
-                peca.get('camada')
-            ))
+                SELECT op_pai, op, peca, projeto, veiculo, local, rack, TRUE, %(usuario)s, 'PU', camada
+                FROM movidas
+            )
+            SELECT COUNT(*) FROM movidas
+        """, {'ids': ids, 'usuario': current_user.username})
+        total_enviadas = cur.fetchone()[0]
         
         # Log da ação
         cur.execute("""
@@ -1343,19 +1686,15 @@ def enviar_estoque():
         """, (
             current_user.username,
             'ENVIAR_ESTOQUE',
-            f'Enviou {len(pecas)} peça(s) para o estoque'
+            f'Enviou {total_enviadas} peça(s) para o estoque'
         ))
         
-        # Remover da tabela de otimizadas
-        placeholders = ','.join(['%s'] * len(ids))
-        cur.execute(f"DELETE FROM public.pu_otimizadas WHERE id IN ({placeholders})", ids)
-        
         conn.commit()
         conn.close()
         
         return jsonify({
             'success': True,
-            'message': f'{len(pecas)} peça(s) enviada(s) para o estoque com sucesso!'
+            'message': f'{total_enviadas} peça(s) enviada(s) para o estoque com sucesso!'
         })
     
     except Exception as e:
@@ -1364,80 +1703,89 @@ def enviar_estoque():
 @app.route('/api/remover-estoque', methods=['POST'])
 @login_required
 def remover_estoque():
-    dados = request.get_json()
+    dados = request.get_json() or {}
     ids = dados.get('ids', [])
     tipo_operacao = dados.get('tipo_operacao', 'saida_individual')
     
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    if not ids:
+        return jsonify({'success': False, 'message': 'Nenhuma peça selecionada'})
+    
+    try:
+        ids = [int(id_item) for id_item in ids]
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'IDs inválidos'}), 400
     
     # Determinar o motivo baseado no tipo de operação
     if tipo_operacao == 'saida_massiva' and len(ids) > 1:
         motivo = 'SAÍDA MASSIVA'
         acao_log = 'SAIDA_MASSIVA'
-        detalhes_log = f'Realizou saída massiva de {len(ids)} peça(s) do estoque'
     else:
         motivo = 'SAÍDA DO ESTOQUE'
         acao_log = 'SAIDA_ESTOQUE'
-        detalhes_log = f'Removeu {len(ids)} peça(s) do estoque'
     
-    for id_item in ids:
-        cur.execute("SELECT * FROM public.pu_inventory WHERE id = %s", (id_item,))
-        peca = cur.fetchone()
-        
-        if peca:
+    try:
+        with conexao_db() as conn:
+            cur = conn.cursor()
+            
+            # Mover todas as peças de uma vez: as linhas removidas do estoque alimentam o histórico de saídas
             cur.execute("""
-                INSERT INTO public.pu_exit (op_pai, op, peca, projeto, veiculo, local, rack, usuario, data, motivo)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP, %s)
+                WITH removidas AS (
+                    DELETE FROM public.pu_inventory
+                    WHERE id = ANY(%(ids)s)
+                    RETURNING id, op_pai, op, peca, projeto, veiculo, local, rack
+                ), saidas AS (
+                    INSERT INTO public.pu_exit (op_pai, op, peca, projeto, veiculo, local, rack, usuario, data, motivo)
+                    SELECT COALESCE(op_pai, ''), op, peca, COALESCE(projeto, ''), COALESCE(veiculo, ''), local,
+                           COALESCE(rack, ''), %(usuario)s, CURRENT_TIMESTAMP, %(motivo)s
+                    FROM removidas
+                )
+                SELECT id FROM removidas
+            """, {'ids': ids, 'usuario': current_user.username, 'motivo': motivo})
+            removidos = {row[0] for row in cur.fetchall()}
+            nao_encontrados = [id_item for id_item in ids if id_item not in removidos]
+            
+            if acao_log == 'SAIDA_MASSIVA':
+                detalhes_log = f'Realizou saída massiva de {len(removidos)} peça(s) do estoque'
+            else:
+                detalhes_log = f'Removeu {len(removidos)} peça(s) do estoque'
+            if nao_encontrados:
+                detalhes_log += f' ({len(nao_encontrados)} não encontrada(s))'
+            
+            # Log da ação
+            cur.execute("""
+                INSERT INTO public.pu_logs (usuario, acao, detalhes, data_acao)
+                VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
             """, (
-                peca.get('op_pai', ''),
-                peca['op'],
-                peca['peca'],
-                peca.get('projeto', ''),
-                peca.get('veiculo', ''),
-                peca['local'],
-                peca.get('rack', ''),
                 current_user.username,
-                motivo
+                acao_log,
+                detalhes_log
             ))
             
-            cur.execute("DELETE FROM public.pu_inventory WHERE id = %s", (id_item,))
-    
-    # Log da ação
-    cur.execute("""
-        INSERT INTO public.pu_logs (usuario, acao, detalhes, data_acao)
-        VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
-    """, (
-        current_user.username,
-        acao_log,
-        detalhes_log
-    ))
-    
-    conn.commit()
-    conn.close()
+            conn.commit()
+        
+        mensagem = f'{len(removidos)} peça(s) removida(s) do estoque!'
+        if nao_encontrados:
+            mensagem += f' {len(nao_encontrados)} peça(s) não encontrada(s) no estoque: {", ".join(map(str, nao_encontrados[:10]))}'
+            if len(nao_encontrados) > 10:
+                mensagem += f' e mais {len(nao_encontrados) - 10}'
+        
+        return jsonify({
+            'success': True,
+            'message': mensagem,
+            'removidos': len(removidos),
+            'nao_encontrados': nao_encontrados
+        })
     
-    return jsonify({'success': True, 'message': f'{len(ids)} peça(s) removida(s) do estoque!'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Erro: {str(e)}'}), 500
 
 @app.route('/api/arquivos')
 @login_required
+@leitura_replica
 def api_arquivos():
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
-        # Resetar sequência do ID para evitar duplicatas
-        try:
-            cur.execute("SELECT setval('arquivos_pu_id_seq', (SELECT COALESCE(MAX(id), 0) + 1 FROM public.arquivos_pu), false)")
-            conn.commit()
-        except:
-            pass
-        
         # Buscar dados
-        cur.execute("SELECT * FROM public.arquivos_pu ORDER BY id DESC")
-        dados = cur.fetchall()
-        conn.close()
-        
-        return jsonify([dict(row) for row in dados])
+        return resposta_json_streaming("SELECT * FROM public.arquivos_pu ORDER BY id DESC")
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -1498,6 +1846,7 @@ def adicionar_arquivo():
         
         conn.commit()
         conn.close()
+        invalidar_arquivos_corte()
         
         response = jsonify({'success': True, 'message': 'Arquivo adicionado com sucesso!'})
         response.headers.add('Access-Control-Allow-Origin', '*')
@@ -1544,6 +1893,7 @@ def editar_arquivo(arquivo_id):
         
         conn.commit()
         conn.close()
+        invalidar_arquivos_corte()
         
         response = jsonify({'success': True, 'message': 'Arquivo atualizado com sucesso!'})
         response.headers.add('Access-Control-Allow-Origin', '*')
@@ -1572,6 +1922,7 @@ def excluir_arquivo(arquivo_id):
         
         conn.commit()
         conn.close()
+        invalidar_arquivos_corte()
         
         response = jsonify({'success': True, 'message': 'Arquivo excluído com sucesso!'})
         response.headers.add('Access-Control-Allow-Origin', '*')
@@ -1583,11 +1934,12 @@ def excluir_arquivo(arquivo_id):
         return response, 500
 
 @app.route('/api/locais')
+@leitura_replica
 def api_locais():
     try:
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute("SELECT id, local, rack, nome, status FROM public.pu_locais ORDER BY id")
+        cur.execute("SELECT id, local, rack, nome, status, capacidade FROM public.pu_locais ORDER BY id")
         dados = cur.fetchall()
         conn.close()
         return jsonify([dict(row) for row in dados])
@@ -1596,19 +1948,17 @@ def api_locais():
 
 @app.route('/api/contagem-pecas-locais')
 @login_required
+@leitura_replica
 def api_contagem_pecas_locais():
     try:
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
         
         cur.execute("""
-            SELECT local, COUNT(*) as total 
-            FROM (
-                SELECT local FROM public.pu_inventory WHERE local IS NOT NULL AND local != ''
-                UNION ALL
-                SELECT local FROM public.pu_otimizadas WHERE tipo = 'PU' AND local IS NOT NULL AND local != ''
-            ) AS combined
+            SELECT local, SUM(estoque + otimizadas) as total 
+            FROM public.pu_ocupacao
             GROUP BY local
+            HAVING SUM(estoque + otimizadas) > 0
         """)
         dados = [dict(row) for row in cur.fetchall()]
         
@@ -1620,6 +1970,7 @@ def api_contagem_pecas_locais():
 
 @app.route('/api/local-detalhes/<local>')
 @login_required
+@leitura_replica
 def api_local_detalhes(local):
     try:
         conn = get_db_connection()
@@ -1643,50 +1994,6 @@ def api_local_detalhes(local):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# Executar uma única vez para popular a tabela
-def popular_locais_iniciais():
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Verificar se tabela pu_locais existe
-        cur.execute("SELECT COUNT(*) FROM public.pu_locais LIMIT 1")
-        print("Tabela pu_locais já existe")
-        
-        conn.close()
-        
-    except Exception as e:
-        print(f"Tabela não existe, criando: {e}")
-        # Se deu erro, criar tabelas básicas
-        try:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS public.pu_locais (
-                    id SERIAL PRIMARY KEY,
-                    local TEXT,
-                    rack TEXT,
-                    status TEXT DEFAULT 'Ativo',
-                    nome TEXT
-                )
-            """)
-            
-            conn.commit()
-            conn.close()
-            print("Tabela pu_locais criada")
-        except Exception as e2:
-            print(f"Erro ao criar tabela: {e2}")
-
-# Executar automaticamente na inicialização
-try:
-    print("Verificando tabelas...")
-    popular_locais_iniciais()
-    print("Verificação concluída!")
-except Exception as e:
-    print(f"Aviso na inicialização: {e}")
-    print("Continuando mesmo assim...")
-
 @app.route('/api/adicionar-local', methods=['POST'])
 @login_required
 def adicionar_local():
@@ -1697,6 +2004,13 @@ def adicionar_local():
 
         if not local or not nome:
             return jsonify({'success': False, 'message': 'Preencha todos os campos.'})
+        
+        try:
+            capacidade = int(data.get('capacidade') or 1)
+        except (TypeError, ValueError):
+            capacidade = 0
+        if capacidade < 1:
+            return jsonify({'success': False, 'message': 'Capacidade deve ser um número inteiro maior que zero.'})
 
         conn = get_db_connection()
         cur = conn.cursor()
@@ -1708,12 +2022,15 @@ def adicionar_local():
             return jsonify({'success': False, 'message': 'Local já existe'})
 
         cur.execute("""
-            INSERT INTO public.pu_locais (local, rack, status, nome)
-            VALUES (%s, %s, %s, %s)
-        """, (local, 'COLMEIA', 'Ativo', nome))
+            INSERT INTO public.pu_locais (local, rack, status, nome, capacidade)
+            VALUES (%s, %s, %s, %s, %s)
+        """, (local, 'COLMEIA', 'Ativo', nome, capacidade))
 
         conn.commit()
         conn.close()
+        
+        # Novo local altera a ordem de preenchimento
+        invalidar_sequencia()
 
         return jsonify({'success': True, 'message': 'Local adicionado com sucesso!'})
 
@@ -1730,15 +2047,25 @@ def alterar_status_local():
 
         if not local or not status:
             return jsonify({'success': False, 'message': 'Dados incompletos'})
+        
+        # Capacidade é opcional; sem ela apenas o status é alterado
+        capacidade = data.get('capacidade')
+        if capacidade is not None:
+            try:
+                capacidade = int(capacidade)
+            except (TypeError, ValueError):
+                capacidade = 0
+            if capacidade < 1:
+                return jsonify({'success': False, 'message': 'Capacidade deve ser um número inteiro maior que zero.'})
 
         conn = get_db_connection()
         cur = conn.cursor()
 
         cur.execute("""
             UPDATE public.pu_locais 
-            SET status = %s 
+            SET status = %s, capacidade = COALESCE(%s, capacidade)
             WHERE local = %s
-        """, (status, local))
+        """, (status, capacidade, local))
 
         if cur.rowcount == 0:
             conn.close()
@@ -1746,6 +2073,9 @@ def alterar_status_local():
 
         conn.commit()
         conn.close()
+        
+        # Local ativado/desativado altera a ordem de preenchimento
+        invalidar_sequencia()
 
         return jsonify({'success': True, 'message': f'Status alterado para {status}!'})
 
@@ -1753,48 +2083,150 @@ def alterar_status_local():
         return jsonify({'success': False, 'message': f'Erro ao alterar status: {str(e)}'})
 
 
-
-@app.route('/api/saidas')
-def api_saidas():
+@app.route('/api/racks')
+@login_required
+@leitura_replica
+def api_racks():
     try:
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute("SELECT id, op, peca, local, usuario, data FROM public.pu_exit ORDER BY id DESC LIMIT 50")
+        cur.execute("SELECT id, nome, numero_inicio, numero_fim, colunas, prioridade, ativo FROM public.pu_racks ORDER BY prioridade, nome")
         dados = cur.fetchall()
         conn.close()
-        
-        resultado = []
-        for row in dados:
-            item = dict(row)
-            if item.get('data'):
-                item['data'] = item['data'].strftime('%d/%m/%Y')
-            resultado.append(item)
-        
-        return jsonify({
-            'dados': resultado,
-            'pagination': {'current_page': 1, 'total_pages': 1, 'total_records': len(resultado), 'limit': 50}
-        })
-    except:
-        return jsonify({'dados': [], 'pagination': {'current_page': 1, 'total_pages': 1, 'total_records': 0, 'limit': 50}})
+        return jsonify([dict(row) for row in dados])
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-@app.route('/api/saidas-exit')
+@app.route('/api/racks', methods=['POST'])
 @login_required
-def api_saidas_exit():
+def salvar_rack():
+    if current_user.setor != 'T.I':
+        return jsonify({'success': False, 'message': 'Acesso negado'}), 403
+    
     try:
+        data = request.get_json()
+        nome = (data.get('nome') or '').strip().upper()
+        colunas = (data.get('colunas') or 'E-M,D-A').strip().upper()
+        ativo = bool(data.get('ativo', True))
+        
+        try:
+            numero_inicio = int(data.get('numero_inicio'))
+            numero_fim = int(data.get('numero_fim'))
+            prioridade = int(data.get('prioridade'))
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'message': 'Números e prioridade devem ser inteiros'})
+        
+        if not nome or numero_inicio > numero_fim:
+            return jsonify({'success': False, 'message': 'Dados do rack inválidos'})
+        
+        # Faixas de colunas no formato "E-M,D-A"
+        if not all(re.fullmatch(r'[A-Z](-[A-Z])?', faixa.strip()) for faixa in colunas.split(',')):
+            return jsonify({'success': False, 'message': 'Colunas devem seguir o formato E-M,D-A'})
+        
         conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute("SELECT op_pai, op, peca, projeto, veiculo, local, rack, usuario, data, motivo FROM public.pu_exit ORDER BY id DESC")
-        dados = cur.fetchall()
+        cur = conn.cursor()
+        
+        cur.execute("""
+            INSERT INTO public.pu_racks (nome, numero_inicio, numero_fim, colunas, prioridade, ativo)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (nome) DO UPDATE SET
+                numero_inicio = EXCLUDED.numero_inicio,
+                numero_fim = EXCLUDED.numero_fim,
+                colunas = EXCLUDED.colunas,
+                prioridade = EXCLUDED.prioridade,
+                ativo = EXCLUDED.ativo
+        """, (nome, numero_inicio, numero_fim, colunas, prioridade, ativo))
+        
+        cur.execute("""
+            INSERT INTO public.pu_logs (usuario, acao, detalhes, data_acao)
+            VALUES (%s, %s, %s, CURRENT_TIMESTAMP)
+        """, (current_user.username, 'SALVAR_RACK', f'Salvou rack {nome} ({numero_inicio}-{numero_fim}, colunas {colunas})'))
+        
+        conn.commit()
         conn.close()
         
-        resultado = []
-        for row in dados:
-            item = dict(row)
-            if item.get('data'):
-                item['data'] = item['data'].strftime('%d/%m/%Y')
-            resultado.append(item)
+        invalidar_sequencia()
         
-        return jsonify(resultado)
+        return jsonify({'success': True, 'message': f'Rack {nome} salvo com sucesso!'})
+    
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Erro ao salvar rack: {str(e)}'})
+
+
+# Limites de página do histórico de saídas
+SAIDAS_LIMITE_PADRAO = 50
+SAIDAS_LIMITE_MAX = 500
+
+def paginar_saidas(colunas):
+    """Página de pu_exit por keyset (id decrescente) com os filtros da query string; custa o mesmo em qualquer página"""
+    limite = min(max(request.args.get('limit', SAIDAS_LIMITE_PADRAO, type=int), 1), SAIDAS_LIMITE_MAX)
+    cursor = request.args.get('cursor', type=int)
+    
+    condicoes, params = [], []
+    if cursor:
+        condicoes.append("id < %s")
+        params.append(cursor)
+    if request.args.get('data_inicio'):
+        condicoes.append("data >= %s::date")
+        params.append(request.args['data_inicio'])
+    if request.args.get('data_fim'):
+        condicoes.append("data < %s::date + 1")
+        params.append(request.args['data_fim'])
+    # Filtros por campo são exatos (usam os índices campo, id); a busca livre é por trecho, como a caixa de pesquisa da tela
+    for campo in ('op', 'peca', 'usuario', 'motivo'):
+        valor = request.args.get(campo, '').strip()
+        if valor:
+            condicoes.append(f"{campo} = %s")
+            params.append(valor)
+    busca = request.args.get('busca', '').strip().lower()
+    for termo in busca.split():
+        termo = termo.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        condicoes.append(f"{EXPRESSAO_BUSCA_SAIDAS} LIKE %s")
+        params.append(f'%{termo}%')
+    
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+    
+    conn = get_db_connection()
+    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    # Uma linha a mais indica se existe próxima página
+    cur.execute(f"SELECT id, {colunas} FROM public.pu_exit {where} ORDER BY id DESC LIMIT %s", params + [limite + 1])
+    linhas = cur.fetchall()
+    conn.close()
+    
+    tem_mais = len(linhas) > limite
+    linhas = linhas[:limite]
+    
+    resultado = []
+    for row in linhas:
+        item = dict(row)
+        if item.get('data'):
+            item['data'] = item['data'].strftime('%d/%m/%Y')
+        resultado.append(item)
+    
+    return {
+        'dados': resultado,
+        'pagination': {
+            'limit': limite,
+            'cursor': cursor,
+            'proximo_cursor': linhas[-1]['id'] if tem_mais else None,
+            'tem_mais': tem_mais
+        }
+    }
+
+@app.route('/api/saidas')
+@leitura_replica
+def api_saidas():
+    try:
+        return jsonify(paginar_saidas("op_pai, op, peca, projeto, veiculo, local, rack, usuario, data, motivo"))
+    except Exception as e:
+        return jsonify({'error': str(e), 'dados': [], 'pagination': {'limit': SAIDAS_LIMITE_PADRAO, 'cursor': None, 'proximo_cursor': None, 'tem_mais': False}}), 500
+
+@app.route('/api/saidas-exit')
+@login_required
+@leitura_replica
+def api_saidas_exit():
+    try:
+        return jsonify(paginar_saidas("op_pai, op, peca, projeto, veiculo, local, rack, usuario, data, motivo"))
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1824,20 +2256,16 @@ def gerar_xml():
         xmls_gerados = []
         xmls_nao_gerados = []
         
+        arquivos_corte = obter_arquivos_corte(conn)
+        
         with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
             for peca_data in pecas_selecionadas:
                 projeto = peca_data.get('projeto', '')
                 peca_codigo = peca_data['peca']
                 op = peca_data['op']
                 
-                # Buscar todas as camadas da peça usando projeto+peca
-                cur.execute("""
-                    SELECT * FROM public.arquivos_pu
-                    WHERE projeto = %s AND peca = %s
-                    ORDER BY camada
-                """, (projeto, peca_codigo))
-                
-                arquivos = cur.fetchall()
+                # Todas as camadas da peça usando projeto+peca
+                arquivos = arquivos_corte.get((projeto, peca_codigo), [])
                 
                 if not arquivos:
                     xmls_nao_gerados.append(f"{projeto} {peca_codigo}")
@@ -2092,6 +2520,69 @@ def gerar_excel_saidas():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Erro ao gerar Excel: {str(e)}'}), 500
 
+# Limites de página dos logs; o limite maior atende a exportação para Excel
+LOGS_LIMITE_PADRAO = 20
+LOGS_LIMITE_MAX = 10000
+
+@app.route('/api/logs')
+@login_required
+@leitura_replica
+def api_logs():
+    """Logs de auditoria por keyset (id decrescente), com busca por trechos de usuário, ação e detalhes"""
+    if current_user.setor != 'T.I' or current_user.role != 'admin':
+        return jsonify({'error': 'Acesso negado'}), 403
+    
+    try:
+        limite = min(max(request.args.get('limit', LOGS_LIMITE_PADRAO, type=int), 1), LOGS_LIMITE_MAX)
+        cursor = request.args.get('cursor', type=int)
+        busca = request.args.get('busca', '').strip().lower()
+        
+        condicoes, params = [], []
+        if cursor:
+            condicoes.append("id < %s")
+            params.append(cursor)
+        
+        # Cada palavra da busca precisa aparecer no texto; curingas digitados são tratados literalmente
+        for termo in busca.split():
+            termo = termo.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            condicoes.append(f"{EXPRESSAO_BUSCA_LOGS} LIKE %s")
+            params.append(f'%{termo}%')
+        
+        where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cur.execute(f"""
+            SELECT id, usuario, acao, detalhes, data_acao FROM public.pu_logs
+            {where}
+            ORDER BY id DESC LIMIT %s
+        """, params + [limite + 1])
+        linhas = cur.fetchall()
+        conn.close()
+        
+        tem_mais = len(linhas) > limite
+        linhas = linhas[:limite]
+        
+        dados = []
+        for row in linhas:
+            item = dict(row)
+            if item['data_acao']:
+                item['data_acao'] = item['data_acao'].isoformat()
+            dados.append(item)
+        
+        return jsonify({
+            'dados': dados,
+            'pagination': {
+                'limit': limite,
+                'cursor': cursor,
+                'proximo_cursor': linhas[-1]['id'] if tem_mais else None,
+                'tem_mais': tem_mais
+            }
+        })
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/gerar-excel-logs', methods=['POST'])
 @login_required
 def gerar_excel_logs():
@@ -2132,6 +2623,7 @@ def gerar_excel_logs():
 
 @app.route('/api/relatorio-controle')
 @login_required
+@leitura_replica
 def api_relatorio_controle():
     try:
         conn = get_db_connection()
@@ -2156,12 +2648,43 @@ def api_relatorio_controle():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Inicialização única por processo; com o gunicorn (preload_app) roda só no mestre, antes do fork
+_lock_inicializacao = threading.Lock()
+_inicializacao = {'feita': False}
+
+def criar_app(tolerar_falha_esquema=False):
+    """Fábrica WSGI: valida a configuração e aplica migrações, índices e projeção de ocupação uma única vez"""
+    with _lock_inicializacao:
+        if not _inicializacao['feita']:
+            verificar_configuracao()
+            print(f"Conectando ao banco: {DB_CONFIG['host']}")
+            try:
+                # Entre processos e servidores diferentes, o lock consultivo de aplicar_esquema serializa a execução
+                print("Verificando tabelas...")
+                with conexao_db() as conn:
+                    aplicar_esquema(conn)
+                print("Verificação concluída!")
+            except Exception as e:
+                # No gunicorn (preload_app) a exceção derruba o mestre antes de criar workers sobre um esquema incompleto
+                if not tolerar_falha_esquema:
+                    fechar_pool_db()
+                    raise
+                print(f"Aviso na inicialização: {e}")
+                print("Continuando mesmo assim...")
+            # Conexões do mestre não devem ser herdadas pelos workers
+            fechar_pool_db()
+            _inicializacao['feita'] = True
+    return app
+
 if __name__ == '__main__':
     try:
-        print("Iniciando servidor Flask...")
-        print("Acesse: http://localhost:9995")
-        app.run(host='0.0.0.0', port=9995, debug=False)
+        # Só o servidor de desenvolvimento sobe com o esquema pendente
+        criar_app(tolerar_falha_esquema=True)
+        porta = int(os.getenv('PORTA', '9995'))
+        print("Iniciando servidor Flask (desenvolvimento; em produção use gunicorn -c gunicorn.conf.py wsgi:app)...")
+        print(f"Acesse: http://localhost:{porta}")
+        app.run(host='0.0.0.0', port=porta, debug=False, threaded=True)
     except Exception as e:
         print(f"Erro ao iniciar servidor: {e}")
         input("Pressione Enter para sair...")
-        exit(1)
\ No newline at end of file
+        exit(1)
@@ -0,0 +1,329 @@
+"""Benchmark da alocação: /api/dados, sugerir_local_armazenamento e /api/otimizar-pecas
+
+Popula um PostgreSQL local descartável com um armazém sintético (3 racks, 84 linhas,
+13 colunas A-M) e com 1k/10k/50k apontamentos em diferentes níveis de ocupação, e mede
+cada operação pelo cliente de testes do Flask: latência, número de consultas e pico de
+memória. O resultado sai em JSON para comparar execuções antes e depois de cada mudança.
+
+Uso (a partir da pasta do projeto, onde fica o .env):
+    python benchmarks/bench_alocacao.py --db pu_bench --saida bench.json
+
+ATENÇÃO: as tabelas do banco informado são apagadas e recriadas. Por segurança o nome
+do banco precisa terminar em "_bench", a menos que --permitir-qualquer-banco seja usado.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+
+import psycopg2
+import psycopg2.extensions
+import psycopg2.extras
+from werkzeug.security import generate_password_hash
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RACKS = {'RACK1': range(1, 29), 'RACK2': range(29, 57), 'RACK3': range(57, 85)}
+COLUNAS = [chr(code) for code in range(ord('A'), ord('M') + 1)]
+PECAS = ['PBS', 'VGA', 'VGE', 'VGD', 'TSP', 'TSA', 'TSB', 'TSC']
+PROJETOS = [f'P{numero:03d}' for numero in range(1, 41)]
+
+USUARIO_BENCH = 'bench'
+SENHA_BENCH = 'bench'
+
+# Tabelas que o sistema espera encontrar prontas no banco
+SCHEMA_BASE = """
+DROP TABLE IF EXISTS public.pu_inventory, public.pu_otimizadas, public.pu_manuais, public.pu_exit,
+    public.pu_logs, public.pu_controle, public.pu_locais, public.pu_racks, public.pu_reservas,
+    public.pu_ocupacao, public.pu_ocupacao_pecas, public.pu_schema_versao, public.pu_topologia_versao, public.users_pu, public.arquivos_pu, public.pu_camadas,
+    public.apontamento_pplug_jarinu CASCADE;
+
+CREATE TABLE public.users_pu (
+    id SERIAL PRIMARY KEY, usuario TEXT UNIQUE, senha TEXT, funcao TEXT, setor TEXT, email TEXT
+);
+CREATE TABLE public.pu_locais (
+    id SERIAL PRIMARY KEY, local TEXT, rack TEXT, status TEXT DEFAULT 'Ativo', nome TEXT,
+    capacidade INTEGER NOT NULL DEFAULT 1
+);
+CREATE TABLE public.pu_inventory (
+    id SERIAL PRIMARY KEY, op_pai TEXT, op TEXT, peca TEXT, projeto TEXT, veiculo TEXT,
+    local TEXT, rack TEXT, camada TEXT, data TIMESTAMP DEFAULT CURRENT_TIMESTAMP, usuario TEXT
+);
+CREATE TABLE public.pu_otimizadas (
+    id SERIAL PRIMARY KEY, op_pai TEXT, op TEXT, peca TEXT, projeto TEXT, veiculo TEXT,
+    local TEXT, rack TEXT, cortada BOOLEAN DEFAULT FALSE, user_otimizacao TEXT,
+    data_otimizacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP, tipo TEXT DEFAULT 'PU', camada TEXT
+);
+CREATE TABLE public.pu_controle (
+    id SERIAL PRIMARY KEY, op_pai TEXT, op TEXT, peca TEXT, projeto TEXT, veiculo TEXT,
+    local TEXT, rack TEXT, cortada BOOLEAN, user_otimizacao TEXT,
+    data_otimizacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP, tipo TEXT, camada TEXT
+);
+CREATE TABLE public.pu_exit (
+    id SERIAL PRIMARY KEY, op_pai TEXT, op TEXT, peca TEXT, projeto TEXT, veiculo TEXT,
+    local TEXT, rack TEXT, usuario TEXT, data TIMESTAMPTZ, motivo TEXT
+);
+CREATE TABLE public.pu_logs (
+    id SERIAL PRIMARY KEY, usuario TEXT, acao TEXT, detalhes TEXT,
+    data_acao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE public.arquivos_pu (
+    id SERIAL PRIMARY KEY, projeto TEXT, peca TEXT, nome_peca TEXT, camada TEXT,
+    espessura DOUBLE PRECISION, quantidade INTEGER
+);
+CREATE TABLE public.pu_camadas (
+    id SERIAL PRIMARY KEY, projeto TEXT, peca TEXT, l1 TEXT, l3 TEXT
+);
+CREATE TABLE public.apontamento_pplug_jarinu (
+    id BIGINT, data TIMESTAMP, etapa TEXT, usuario TEXT, colaborador TEXT, cliente TEXT,
+    op BIGINT, prioridade TEXT, item TEXT, serial TEXT, modelo TEXT, obs TEXT, cabine TEXT,
+    etapa_refugo TEXT, motivo TEXT, resumo TEXT, status TEXT, produto TEXT, etapa_resp TEXT,
+    projeto TEXT, veiculo TEXT, codigo_de_barras TEXT, m2 DOUBLE PRECISION, projeto_peca TEXT
+);
+"""
+
+# Contador global de comandos enviados ao banco
+consultas = {'total': 0}
+_cursores_contados = {}
+
+
+def _cursor_contado(base):
+    """Subclasse do cursor que conta cada execute/executemany enviado ao servidor"""
+    if base not in _cursores_contados:
+        class CursorContado(base):
+            def execute(self, *args, **kwargs):
+                consultas['total'] += 1
+                return super().execute(*args, **kwargs)
+
+            def executemany(self, *args, **kwargs):
+                consultas['total'] += 1
+                return super().executemany(*args, **kwargs)
+
+        _cursores_contados[base] = CursorContado
+    return _cursores_contados[base]
+
+
+class ConexaoContada(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        kwargs['cursor_factory'] = _cursor_contado(kwargs.get('cursor_factory') or psycopg2.extensions.cursor)
+        return super().cursor(*args, **kwargs)
+
+
+def conectar(args):
+    return psycopg2.connect(host=args.host, port=args.port, user=args.user, password=args.password, dbname=args.db)
+
+
+def criar_schema(args):
+    conn = conectar(args)
+    cur = conn.cursor()
+    cur.execute(SCHEMA_BASE)
+
+    locais = [
+        (f"{letra}{numero}", 'COLMEIA', 'Ativo', rack)
+        for rack, numeros in RACKS.items() for numero in numeros for letra in COLUNAS
+    ]
+    psycopg2.extras.execute_values(cur, "INSERT INTO public.pu_locais (local, rack, status, nome) VALUES %s", locais)
+
+    cur.execute(
+        "INSERT INTO public.users_pu (usuario, senha, funcao, setor, email) VALUES (%s, %s, 'admin', 'T.I', 'bench@localhost')",
+        (USUARIO_BENCH, generate_password_hash(SENHA_BENCH))
+    )
+
+    # Metade das combinações projeto+peça com arquivo de corte e camadas
+    combinacoes = [(projeto, peca) for projeto in PROJETOS for peca in PECAS if random.random() < 0.5]
+    psycopg2.extras.execute_values(cur, """
+        INSERT INTO public.arquivos_pu (projeto, peca, nome_peca, camada, espessura, quantidade) VALUES %s
+    """, [(projeto, peca, f'{projeto}_{peca}', 'L1', 0.5, 1) for projeto, peca in combinacoes])
+    psycopg2.extras.execute_values(cur, """
+        INSERT INTO public.pu_camadas (projeto, peca, l1, l3) VALUES %s
+    """, [(projeto, peca, '1', '2') for projeto, peca in combinacoes])
+
+    conn.commit()
+    conn.close()
+    return [local for local, _, _, _ in locais]
+
+
+def popular_cenario(args, app_module, locais, total_apontamentos, ocupacao):
+    """Limpa as tabelas transacionais e gera o estoque e os apontamentos do cenário"""
+    conn = conectar(args)
+    cur = conn.cursor()
+    cur.execute("""
+        TRUNCATE public.pu_inventory, public.pu_otimizadas, public.pu_manuais, public.pu_reservas,
+            public.pu_controle, public.pu_exit, public.pu_logs, public.apontamento_pplug_jarinu
+        RESTART IDENTITY
+    """)
+
+    ocupados = random.sample(locais, int(len(locais) * ocupacao))
+    psycopg2.extras.execute_values(cur, """
+        INSERT INTO public.pu_inventory (op_pai, op, peca, projeto, veiculo, local, rack, camada, usuario) VALUES %s
+    """, [
+        ('0', str(900000 + i), random.choice(PECAS), random.choice(PROJETOS), 'VEICULO BENCH', local, 'COLMEIA', 'L1', USUARIO_BENCH)
+        for i, local in enumerate(ocupados)
+    ], page_size=1000)
+
+    agora = datetime.now()
+    psycopg2.extras.execute_values(cur, """
+        INSERT INTO public.apontamento_pplug_jarinu (id, data, etapa, op, item, projeto, veiculo) VALUES %s
+    """, [
+        (i + 1, agora - timedelta(minutes=i), 'FILA', 100000 + i, random.choice(PECAS), random.choice(PROJETOS), 'VEICULO BENCH')
+        for i in range(total_apontamentos)
+    ], page_size=1000)
+
+    # TRUNCATE não dispara os triggers de linha: reconstruir a projeção de ocupação
+    from esquema import reconstruir_projecao_ocupacao
+    reconstruir_projecao_ocupacao(cur)
+
+    conn.commit()
+    conn.close()
+
+
+def medir(funcao, repeticoes):
+    """Executa a função várias vezes e retorna latência, consultas e pico de memória"""
+    latencias, contagens, picos = [], [], []
+
+    for _ in range(repeticoes):
+        consultas['total'] = 0
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        funcao()
+        latencias.append((time.perf_counter() - inicio) * 1000)
+        picos.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        contagens.append(consultas['total'])
+
+    latencias.sort()
+    return {
+        'repeticoes': repeticoes,
+        'latencia_ms': {
+            'min': round(latencias[0], 2),
+            'mediana': round(statistics.median(latencias), 2),
+            'p95': round(latencias[min(len(latencias) - 1, int(len(latencias) * 0.95))], 2),
+            'max': round(latencias[-1], 2)
+        },
+        'consultas': max(contagens),
+        'pico_memoria_kb': round(max(picos) / 1024, 1)
+    }
+
+
+def executar_cenario(args, app_module, cliente, locais, total_apontamentos, ocupacao):
+    popular_cenario(args, app_module, locais, total_apontamentos, ocupacao)
+    resultado = {'apontamentos': total_apontamentos, 'ocupacao': ocupacao, 'operacoes': {}}
+
+    def coletar():
+        resposta = cliente.get('/api/dados?etapa=FILA')
+        if resposta.status_code != 200:
+            raise RuntimeError(f'/api/dados retornou {resposta.status_code}: {resposta.get_data(as_text=True)[:200]}')
+        return resposta.get_json()
+
+    resultado['operacoes']['api_dados'] = medir(coletar, args.repeticoes)
+
+    def sugerir():
+        conn = app_module.get_db_connection()
+        try:
+            app_module.sugerir_local_armazenamento(random.choice(PECAS), set(), conn)
+        finally:
+            conn.close()
+
+    resultado['operacoes']['sugerir_local_armazenamento'] = medir(sugerir, args.repeticoes)
+
+    # Otimização: cada repetição coleta (fora da medição), otimiza e desfaz a otimização
+    latencias = []
+    for _ in range(args.repeticoes):
+        pecas = [item for item in coletar() if item['local'] != 'SEM LOCAL'][:args.pecas_otimizacao]
+        if not pecas:
+            break
+
+        medicao = medir(lambda: cliente.post('/api/otimizar-pecas', json={'pecas': pecas}), 1)
+        latencias.append(medicao)
+
+        conn = conectar(args)
+        cur = conn.cursor()
+        cur.execute("DELETE FROM public.pu_otimizadas WHERE user_otimizacao = %s", (USUARIO_BENCH,))
+        conn.commit()
+        conn.close()
+
+    if latencias:
+        amostras = sorted(medicao['latencia_ms']['mediana'] for medicao in latencias)
+        resultado['operacoes']['otimizar_pecas'] = {
+            'repeticoes': len(latencias),
+            'pecas': args.pecas_otimizacao,
+            'latencia_ms': {
+                'min': amostras[0],
+                'mediana': round(statistics.median(amostras), 2),
+                'p95': amostras[min(len(amostras) - 1, int(len(amostras) * 0.95))],
+                'max': amostras[-1]
+            },
+            'consultas': max(medicao['consultas'] for medicao in latencias),
+            'pico_memoria_kb': max(medicao['pico_memoria_kb'] for medicao in latencias)
+        }
+
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark da alocação de locais de PU')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', default='5432')
+    parser.add_argument('--user', default=os.getenv('USER', 'postgres'))
+    parser.add_argument('--password', default='')
+    parser.add_argument('--db', required=True, help='Banco descartável (será apagado)')
+    parser.add_argument('--apontamentos', default='1000,10000,50000', help='Tamanhos separados por vírgula')
+    parser.add_argument('--ocupacoes', default='0,0.5,0.9', help='Frações de locais ocupados separadas por vírgula')
+    parser.add_argument('--repeticoes', type=int, default=5)
+    parser.add_argument('--pecas-otimizacao', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--saida', help='Arquivo JSON de saída (padrão: stdout)')
+    parser.add_argument('--permitir-qualquer-banco', action='store_true')
+    args = parser.parse_args()
+
+    if not args.db.endswith('_bench') and not args.permitir_qualquer_banco:
+        parser.error('o nome do banco precisa terminar em "_bench" (ou use --permitir-qualquer-banco)')
+
+    random.seed(args.seed)
+    locais = criar_schema(args)
+
+    # As variáveis já definidas têm prioridade sobre o .env carregado pelo app
+    os.environ.update({'DB_HOST': args.host, 'DB_PORT': str(args.port), 'DB_USER': args.user, 'DB_PSW': args.password, 'DB_NAME': args.db})
+    sys.path.insert(0, RAIZ)
+    os.chdir(RAIZ)
+
+    with open(os.devnull, 'w') as nulo, redirect_stdout(nulo):
+        import app as app_module
+        app_module.criar_app()
+        app_module.DB_CONFIG['connection_factory'] = ConexaoContada
+        # Conexões abertas na inicialização do app não passam pelo contador
+        app_module.fechar_pool_db()
+
+        cliente = app_module.app.test_client()
+        cliente.post('/login', data={'username': USUARIO_BENCH, 'password': SENHA_BENCH})
+
+        cenarios = [
+            executar_cenario(args, app_module, cliente, locais, int(total), float(ocupacao))
+            for total in args.apontamentos.split(',')
+            for ocupacao in args.ocupacoes.split(',')
+        ]
+
+    relatorio = {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'armazem': {'racks': len(RACKS), 'linhas': sum(len(numeros) for numeros in RACKS.values()), 'colunas': len(COLUNAS), 'locais': len(locais)},
+        'parametros': {'repeticoes': args.repeticoes, 'pecas_otimizacao': args.pecas_otimizacao, 'seed': args.seed},
+        'cenarios': cenarios
+    }
+
+    texto = json.dumps(relatorio, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(texto)
+    else:
+        print(texto)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""Benchmark da gravação de apontamentos: to_sql (caminho antigo) x COPY para tabela temporária + merge
+
+Gera lotes sintéticos com as colunas de apontamento_pplug_jarinu (10k e 100k linhas por
+padrão) e mede, em um PostgreSQL local descartável, o tempo de cada caminho de gravação:
+    - to_sql: DataFrame.to_sql(..., if_exists='append') pelo SQLAlchemy, como a ingestão fazia;
+    - copy: carregar_lote(), COPY FROM STDIN em CSV na memória + INSERT ... ON CONFLICT;
+    - copy_reingestao: o mesmo lote de novo, com todos os ids já existentes (só o merge descarta).
+O resultado sai em JSON para comparar execuções.
+
+Uso (a partir da pasta do projeto):
+    python benchmarks/bench_ingestao.py --db pu_bench --saida bench_ingestao.json
+
+ATENÇÃO: a tabela apontamento_pplug_jarinu do banco informado é apagada e recriada. Por
+segurança o nome do banco precisa terminar em "_bench", a menos que --permitir-qualquer-banco
+seja usado.
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+import psycopg2
+from sqlalchemy import create_engine
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from apontamentos_pplug_jarinu import carregar_lote
+from esquema import _v8_apontamentos
+
+ETAPAS = ['CORTE', 'MONTAGEM', 'AUTOCLAVE', 'EXPEDICAO']
+PECAS = ['PBS', 'VGA', 'VGE', 'VGD', 'TSP', 'TSA', 'TSB', 'TSC']
+PROJETOS = [f'P{numero:03d}' for numero in range(1, 41)]
+
+
+def conectar(args):
+    return psycopg2.connect(host=args.host, port=args.port, user=args.user, password=args.password, dbname=args.db)
+
+
+def recriar_tabela(args):
+    conn = conectar(args)
+    cur = conn.cursor()
+    cur.execute("DROP TABLE IF EXISTS public.apontamento_pplug_jarinu")
+    _v8_apontamentos(cur)
+    cur.execute("CREATE UNIQUE INDEX idx_apontamento_pplug_jarinu_id ON public.apontamento_pplug_jarinu (id)")
+    conn.commit()
+    conn.close()
+
+
+def esvaziar_tabela(args):
+    conn = conectar(args)
+    cur = conn.cursor()
+    cur.execute("TRUNCATE public.apontamento_pplug_jarinu")
+    conn.commit()
+    conn.close()
+
+
+def gerar_lote(total, primeiro_id=1):
+    """Lote com as colunas e tipos produzidos por transformar_apontamentos"""
+    inicio = datetime(2024, 1, 1, 6, 0)
+    linhas = []
+    for deslocamento in range(total):
+        projeto = random.choice(PROJETOS)
+        peca = random.choice(PECAS)
+        op = random.randint(100000, 999999)
+        linhas.append({
+            'id': primeiro_id + deslocamento,
+            'data': inicio + timedelta(seconds=deslocamento * 30),
+            'etapa': random.choice(ETAPAS),
+            'usuario': f'operador{random.randint(1, 50)}',
+            'colaborador': f'colaborador{random.randint(1, 200)}',
+            'cliente': 'CLIENTE',
+            'op': op,
+            'prioridade': 'NORMAL',
+            'item': peca,
+            'serial': f'S{random.randint(1, 10 ** 8):08d}',
+            'modelo': f'{projeto} SEDAN MODELO',
+            'obs': None,
+            'cabine': None,
+            'etapa_refugo': None,
+            'motivo': None,
+            'resumo': 'OK',
+            'status': 'APONTADO',
+            'produto': 'PU',
+            'etapa_resp': None,
+            'projeto': projeto,
+            'veiculo': 'MODELO',
+            'codigo_de_barras': f'{peca}{op}',
+            'm2': round(random.uniform(0.5, 4.0), 3),
+            'projeto_peca': f'{projeto}{peca}'
+        })
+
+    df = pd.DataFrame(linhas)
+    df['id'] = df['id'].astype(pd.Int64Dtype())
+    df['op'] = df['op'].astype(pd.Int64Dtype())
+    return df
+
+
+def resumir(amostras):
+    amostras = sorted(amostras)
+    return {'min': amostras[0], 'mediana': round(statistics.median(amostras), 2), 'max': amostras[-1]}
+
+
+def medir_to_sql(args, engine, df):
+    esvaziar_tabela(args)
+    inicio = time.perf_counter()
+    df.to_sql('apontamento_pplug_jarinu', engine, schema='public', index=False, if_exists='append')
+    return round((time.perf_counter() - inicio) * 1000, 2)
+
+
+def medir_copy(args, df, esvaziar=True):
+    if esvaziar:
+        esvaziar_tabela(args)
+    conn = conectar(args)
+    try:
+        inicio = time.perf_counter()
+        inseridos = carregar_lote(conn, df)
+        conn.commit()
+        return round((time.perf_counter() - inicio) * 1000, 2), inseridos
+    finally:
+        conn.close()
+
+
+def executar_cenario(args, engine, total):
+    df = gerar_lote(total)
+    tempos = {'to_sql': [], 'copy': [], 'copy_reingestao': []}
+
+    for _ in range(args.repeticoes):
+        tempos['to_sql'].append(medir_to_sql(args, engine, df))
+
+        tempo, inseridos = medir_copy(args, df)
+        assert inseridos == total, f'COPY inseriu {inseridos} de {total} linhas'
+        tempos['copy'].append(tempo)
+
+        # Mesmo lote com a tabela já carregada: o ON CONFLICT descarta tudo
+        tempo, inseridos = medir_copy(args, df, esvaziar=False)
+        assert inseridos == 0, f'reingestão inseriu {inseridos} linhas'
+        tempos['copy_reingestao'].append(tempo)
+
+    resultado = {'linhas': total, 'tempo_ms': {caminho: resumir(amostras) for caminho, amostras in tempos.items()}}
+    mediana_to_sql = resultado['tempo_ms']['to_sql']['mediana']
+    mediana_copy = resultado['tempo_ms']['copy']['mediana']
+    resultado['aceleracao_copy'] = round(mediana_to_sql / mediana_copy, 1) if mediana_copy else None
+    resultado['linhas_por_segundo_copy'] = round(total / (mediana_copy / 1000)) if mediana_copy else None
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark da gravação de apontamentos (to_sql x COPY)')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', default='5432')
+    parser.add_argument('--user', default=os.getenv('USER', 'postgres'))
+    parser.add_argument('--password', default='')
+    parser.add_argument('--db', required=True, help='Banco descartável (a tabela de apontamentos será apagada)')
+    parser.add_argument('--tamanhos', default='10000,100000', help='Linhas por lote, separadas por vírgula')
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--saida', help='Arquivo JSON de saída (padrão: stdout)')
+    parser.add_argument('--permitir-qualquer-banco', action='store_true')
+    args = parser.parse_args()
+
+    if not args.db.endswith('_bench') and not args.permitir_qualquer_banco:
+        parser.error('o nome do banco precisa terminar em "_bench" (ou use --permitir-qualquer-banco)')
+
+    random.seed(args.seed)
+    recriar_tabela(args)
+    engine = create_engine(f'postgresql://{args.user}:{args.password}@{args.host}:{args.port}/{args.db}')
+
+    try:
+        cenarios = [executar_cenario(args, engine, int(total)) for total in args.tamanhos.split(',')]
+    finally:
+        engine.dispose()
+
+    relatorio = {
+        'data': datetime.now().isoformat(timespec='seconds'),
+        'parametros': {'repeticoes': args.repeticoes, 'seed': args.seed},
+        'cenarios': cenarios
+    }
+
+    texto = json.dumps(relatorio, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(texto)
+    else:
+        print(texto)
+
+
+if __name__ == '__main__':
+    main()
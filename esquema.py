@@ -0,0 +1,639 @@
+from alocacao import TOPOLOGIA_PADRAO
+
+# Chave do advisory lock que serializa o bootstrap entre processos iniciando ao mesmo tempo
+CHAVE_LOCK_ESQUEMA = 7362001
+
+
+def _v1_locais_racks(cur):
+    """Locais (com capacidade) e topologia dos racks com RACK1..RACK3 cadastrados"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS public.pu_locais (
+            id SERIAL PRIMARY KEY,
+            local TEXT,
+            rack TEXT,
+            status TEXT DEFAULT 'Ativo',
+            nome TEXT,
+            capacidade INTEGER NOT NULL DEFAULT 1
+        )
+    """)
+    # Quantidade de peças (do mesmo tipo) que cada local comporta
+    cur.execute("ALTER TABLE public.pu_locais ADD COLUMN IF NOT EXISTS capacidade INTEGER NOT NULL DEFAULT 1")
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS public.pu_racks (
+            id SERIAL PRIMARY KEY,
+            nome TEXT UNIQUE NOT NULL,
+            numero_inicio INTEGER NOT NULL,
+            numero_fim INTEGER NOT NULL,
+            colunas TEXT NOT NULL DEFAULT 'E-M,D-A',
+            prioridade INTEGER NOT NULL,
+            ativo BOOLEAN DEFAULT TRUE
+        )
+    """)
+    for rack in TOPOLOGIA_PADRAO:
+        cur.execute("""
+            INSERT INTO public.pu_racks (nome, numero_inicio, numero_fim, colunas, prioridade)
+            VALUES (%(nome)s, %(numero_inicio)s, %(numero_fim)s, %(colunas)s, %(prioridade)s)
+            ON CONFLICT (nome) DO NOTHING
+        """, rack)
+
+
+def _v2_estoque_otimizadas_manuais(cur):
+    """Tabelas que as rotas criavam sob demanda a cada chamada"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS public.pu_inventory (
+            id SERIAL PRIMARY KEY,
+            op_pai TEXT,
+            op TEXT,
+            peca TEXT,
+            projeto TEXT,
+            veiculo TEXT,
+            local TEXT,
+            rack TEXT,
+            camada TEXT,
+            data TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            usuario TEXT
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS public.pu_otimizadas (
+            id SERIAL PRIMARY KEY,
+            op_pai TEXT,
+            op TEXT,
+            peca TEXT,
+            projeto TEXT,
+            veiculo TEXT,
+            local TEXT,
+            rack TEXT,
+            cortada BOOLEAN DEFAULT FALSE,
+            user_otimizacao TEXT,
+            data_otimizacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            tipo TEXT DEFAULT 'PU',
+            camada TEXT
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS public.pu_manuais (
+            id SERIAL PRIMARY KEY,
+            op TEXT,
+            peca TEXT,
+            projeto TEXT,
+            veiculo TEXT,
+            local TEXT,
+            rack TEXT,
+            arquivo TEXT,
+            usuario TEXT,
+            data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def _v3_reservas(cur):
+    """Reservas temporárias de locais das sessões de coleta, uma linha por peça"""
+    # Layout antigo (uma reserva por local) é descartado: as reservas são temporárias
+    cur.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = 'pu_reservas' AND column_name = 'local'
+        AND NOT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = 'pu_reservas' AND column_name = 'id'
+        )
+    """)
+    if cur.fetchone():
+        cur.execute("DROP TABLE public.pu_reservas")
+
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS public.pu_reservas (
+            id SERIAL PRIMARY KEY,
+            local TEXT NOT NULL,
+            sessao TEXT NOT NULL,
+            op TEXT,
+            peca TEXT,
+            usuario TEXT,
+            expira_em TIMESTAMPTZ NOT NULL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_pu_reservas_local ON public.pu_reservas (local)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_pu_reservas_sessao ON public.pu_reservas (sessao)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_pu_reservas_expira_em ON public.pu_reservas (expira_em)")
+
+
+def _v4_projecao_ocupacao(cur):
+    """Projeção pu_ocupacao (local, peça, quantidades por origem) mantida por triggers"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS public.pu_ocupacao (
+            local TEXT NOT NULL,
+            peca TEXT NOT NULL,
+            estoque INTEGER NOT NULL DEFAULT 0,
+            otimizadas INTEGER NOT NULL DEFAULT 0,
+            manuais INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (local, peca)
+        )
+    """)
+
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION public.pu_ocupacao_ajustar(p_local TEXT, p_peca TEXT, p_origem TEXT, p_delta INTEGER)
+        RETURNS void AS $$
+        BEGIN
+            IF p_local IS NULL OR p_local = '' THEN
+                RETURN;
+            END IF;
+
+            INSERT INTO public.pu_ocupacao AS o (local, peca, estoque, otimizadas, manuais)
+            VALUES (
+                p_local, COALESCE(p_peca, ''),
+                CASE WHEN p_origem = 'estoque' THEN p_delta ELSE 0 END,
+                CASE WHEN p_origem = 'otimizadas' THEN p_delta ELSE 0 END,
+                CASE WHEN p_origem = 'manuais' THEN p_delta ELSE 0 END
+            )
+            ON CONFLICT (local, peca) DO UPDATE SET
+                estoque = o.estoque + EXCLUDED.estoque,
+                otimizadas = o.otimizadas + EXCLUDED.otimizadas,
+                manuais = o.manuais + EXCLUDED.manuais;
+
+            DELETE FROM public.pu_ocupacao
+            WHERE local = p_local AND peca = COALESCE(p_peca, '')
+              AND estoque <= 0 AND otimizadas <= 0 AND manuais <= 0;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+
+    # Em pu_otimizadas só contam as linhas tipo 'PU'; nas demais tabelas a coluna não existe
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION public.pu_ocupacao_trigger()
+        RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') AND COALESCE(to_jsonb(OLD)->>'tipo', 'PU') = 'PU' THEN
+                PERFORM public.pu_ocupacao_ajustar(OLD.local, OLD.peca, TG_ARGV[0], -1);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND COALESCE(to_jsonb(NEW)->>'tipo', 'PU') = 'PU' THEN
+                PERFORM public.pu_ocupacao_ajustar(NEW.local, NEW.peca, TG_ARGV[0], 1);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+
+    for tabela, origem, colunas in [
+        ('pu_inventory', 'estoque', 'local, peca'),
+        ('pu_otimizadas', 'otimizadas', 'local, peca, tipo'),
+        ('pu_manuais', 'manuais', 'local, peca')
+    ]:
+        cur.execute(f"DROP TRIGGER IF EXISTS trg_{tabela}_ocupacao ON public.{tabela}")
+        cur.execute(f"""
+            CREATE TRIGGER trg_{tabela}_ocupacao
+            AFTER INSERT OR UPDATE OF {colunas} OR DELETE ON public.{tabela}
+            FOR EACH ROW EXECUTE FUNCTION public.pu_ocupacao_trigger('{origem}')
+        """)
+
+
+def _v5_logs(cur):
+    """Log de auditoria, consultado por /api/logs"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS public.pu_logs (
+            id SERIAL PRIMARY KEY,
+            usuario TEXT,
+            acao TEXT,
+            detalhes TEXT,
+            data_acao TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def _v6_jobs(cur):
+    """Jobs em segundo plano, no máximo um ativo por tipo"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS public.pu_jobs (
+            id TEXT PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pendente',
+            etapa TEXT,
+            detalhes JSONB NOT NULL DEFAULT '{}',
+            mensagem TEXT,
+            usuario TEXT,
+            criado_em TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            iniciado_em TIMESTAMPTZ,
+            concluido_em TIMESTAMPTZ
+        )
+    """)
+    cur.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_pu_jobs_tipo_ativo ON public.pu_jobs (tipo)
+        WHERE status IN ('pendente', 'executando')
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_pu_jobs_concluido_em ON public.pu_jobs (concluido_em)")
+
+
+def _v7_ingestao_watermark(cur):
+    """Watermark da ingestão incremental de apontamentos, uma linha por fonte"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS public.pu_ingestao_watermark (
+            fonte TEXT PRIMARY KEY,
+            ultimo_id BIGINT NOT NULL DEFAULT 0,
+            ultima_data TIMESTAMP,
+            dia_aberto DATE NOT NULL,
+            atualizado_em TIMESTAMPTZ NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def _v8_apontamentos(cur):
+    """Tabela de apontamentos do pplug, antes criada pelo primeiro to_sql da ingestão"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS public.apontamento_pplug_jarinu (
+            id BIGINT, data TIMESTAMP, etapa TEXT, usuario TEXT, colaborador TEXT, cliente TEXT,
+            op BIGINT, prioridade TEXT, item TEXT, serial TEXT, modelo TEXT, obs TEXT, cabine TEXT,
+            etapa_refugo TEXT, motivo TEXT, resumo TEXT, status TEXT, produto TEXT, etapa_resp TEXT,
+            projeto TEXT, veiculo TEXT, codigo_de_barras TEXT, m2 DOUBLE PRECISION, projeto_peca TEXT
+        )
+    """)
+
+
+def _garantir_id_unico_apontamentos(cur):
+    """Índice único em apontamento_pplug_jarinu(id), usado pelo ON CONFLICT da ingestão; duplicatas antigas são removidas"""
+    cur.execute("SELECT to_regclass('public.idx_apontamento_pplug_jarinu_id') IS NOT NULL")
+    if cur.fetchone()[0] or not _tabela_existe(cur, 'apontamento_pplug_jarinu'):
+        return
+
+    cur.execute("SAVEPOINT id_apontamentos")
+    try:
+        cur.execute("""
+            DELETE FROM public.apontamento_pplug_jarinu a
+            USING public.apontamento_pplug_jarinu b
+            WHERE a.id = b.id AND a.ctid > b.ctid
+        """)
+        if cur.rowcount:
+            print(f"Esquema: {cur.rowcount} apontamento(s) com id duplicado removido(s)")
+        cur.execute("CREATE UNIQUE INDEX idx_apontamento_pplug_jarinu_id ON public.apontamento_pplug_jarinu (id)")
+        cur.execute("RELEASE SAVEPOINT id_apontamentos")
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT id_apontamentos")
+        print(f"Esquema: índice único de apontamentos não criado ({e})")
+
+
+def _v9_topologia_versao(cur):
+    """Versão da topologia (locais e racks), incrementada por triggers para invalidar o cache de todos os processos"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS public.pu_topologia_versao (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            versao BIGINT NOT NULL DEFAULT 0
+        )
+    """)
+    cur.execute("INSERT INTO public.pu_topologia_versao (id, versao) VALUES (TRUE, 0) ON CONFLICT (id) DO NOTHING")
+
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION public.pu_topologia_incrementar()
+        RETURNS trigger AS $$
+        BEGIN
+            UPDATE public.pu_topologia_versao SET versao = versao + 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+
+    for tabela in ('pu_locais', 'pu_racks'):
+        cur.execute(f"DROP TRIGGER IF EXISTS trg_{tabela}_topologia ON public.{tabela}")
+        cur.execute(f"""
+            CREATE TRIGGER trg_{tabela}_topologia
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.{tabela}
+            FOR EACH STATEMENT EXECUTE FUNCTION public.pu_topologia_incrementar()
+        """)
+
+
+def _v10_ocupacao_por_peca(cur):
+    """pu_ocupacao passa a contar peças distintas: as linhas de camada (L1/L3) de uma mesma peça contam uma vez"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS public.pu_ocupacao_pecas (
+            local TEXT NOT NULL,
+            peca TEXT NOT NULL,
+            origem TEXT NOT NULL,
+            chave TEXT NOT NULL,
+            linhas INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (local, peca, origem, chave)
+        )
+    """)
+
+    # Uma peça é identificada pela OP; linhas sem OP contam cada uma como uma peça
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION public.pu_ocupacao_chave(p_op TEXT, p_id INTEGER)
+        RETURNS TEXT AS $$
+            SELECT CASE WHEN COALESCE(p_op, '') = '' THEN 'id:' || p_id ELSE p_op END
+        $$ LANGUAGE sql IMMUTABLE
+    """)
+
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION public.pu_ocupacao_ajustar(p_local TEXT, p_peca TEXT, p_chave TEXT, p_origem TEXT, p_delta INTEGER)
+        RETURNS void AS $$
+        DECLARE
+            v_linhas INTEGER;
+            v_pecas INTEGER;
+        BEGIN
+            IF p_local IS NULL OR p_local = '' THEN
+                RETURN;
+            END IF;
+
+            INSERT INTO public.pu_ocupacao_pecas AS l (local, peca, origem, chave, linhas)
+            VALUES (p_local, COALESCE(p_peca, ''), p_origem, p_chave, p_delta)
+            ON CONFLICT (local, peca, origem, chave) DO UPDATE SET linhas = l.linhas + EXCLUDED.linhas
+            RETURNING linhas INTO v_linhas;
+
+            -- A ocupação só muda quando entra a primeira linha da peça ou sai a última
+            IF p_delta > 0 AND v_linhas = p_delta THEN
+                v_pecas := 1;
+            ELSIF p_delta < 0 AND v_linhas <= 0 THEN
+                v_pecas := -1;
+                DELETE FROM public.pu_ocupacao_pecas
+                WHERE local = p_local AND peca = COALESCE(p_peca, '') AND origem = p_origem AND chave = p_chave;
+            ELSE
+                RETURN;
+            END IF;
+
+            INSERT INTO public.pu_ocupacao AS o (local, peca, estoque, otimizadas, manuais)
+            VALUES (
+                p_local, COALESCE(p_peca, ''),
+                CASE WHEN p_origem = 'estoque' THEN v_pecas ELSE 0 END,
+                CASE WHEN p_origem = 'otimizadas' THEN v_pecas ELSE 0 END,
+                CASE WHEN p_origem = 'manuais' THEN v_pecas ELSE 0 END
+            )
+            ON CONFLICT (local, peca) DO UPDATE SET
+                estoque = o.estoque + EXCLUDED.estoque,
+                otimizadas = o.otimizadas + EXCLUDED.otimizadas,
+                manuais = o.manuais + EXCLUDED.manuais;
+
+            DELETE FROM public.pu_ocupacao
+            WHERE local = p_local AND peca = COALESCE(p_peca, '')
+              AND estoque <= 0 AND otimizadas <= 0 AND manuais <= 0;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION public.pu_ocupacao_trigger()
+        RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') AND COALESCE(to_jsonb(OLD)->>'tipo', 'PU') = 'PU' THEN
+                PERFORM public.pu_ocupacao_ajustar(OLD.local, OLD.peca, public.pu_ocupacao_chave(OLD.op, OLD.id), TG_ARGV[0], -1);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND COALESCE(to_jsonb(NEW)->>'tipo', 'PU') = 'PU' THEN
+                PERFORM public.pu_ocupacao_ajustar(NEW.local, NEW.peca, public.pu_ocupacao_chave(NEW.op, NEW.id), TG_ARGV[0], 1);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    cur.execute("DROP FUNCTION IF EXISTS public.pu_ocupacao_ajustar(TEXT, TEXT, TEXT, INTEGER)")
+
+    # A OP agora faz parte da chave da peça: alterá-la também ajusta a projeção
+    for tabela, origem, colunas in [
+        ('pu_inventory', 'estoque', 'local, peca, op'),
+        ('pu_otimizadas', 'otimizadas', 'local, peca, op, tipo'),
+        ('pu_manuais', 'manuais', 'local, peca, op')
+    ]:
+        cur.execute(f"DROP TRIGGER IF EXISTS trg_{tabela}_ocupacao ON public.{tabela}")
+        cur.execute(f"""
+            CREATE TRIGGER trg_{tabela}_ocupacao
+            AFTER INSERT OR UPDATE OF {colunas} OR DELETE ON public.{tabela}
+            FOR EACH ROW EXECUTE FUNCTION public.pu_ocupacao_trigger('{origem}')
+        """)
+
+
+def _v11_usuarios_versao(cur):
+    """Versão de users_pu, para que o cache de usuários de cada processo perceba edições e exclusões feitas em outro"""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS public.pu_usuarios_versao (
+            id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+            versao BIGINT NOT NULL DEFAULT 0
+        )
+    """)
+    cur.execute("INSERT INTO public.pu_usuarios_versao (id, versao) VALUES (TRUE, 0) ON CONFLICT (id) DO NOTHING")
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION public.pu_usuarios_incrementar()
+        RETURNS trigger AS $$
+        BEGIN
+            UPDATE public.pu_usuarios_versao SET versao = versao + 1;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+
+
+def _v12_indice_etapa_upper(cur):
+    """Remove o índice (etapa, data): /api/dados compara UPPER(etapa) e só usa o índice por expressão de INDICES"""
+    cur.execute("DROP INDEX IF EXISTS public.idx_apontamento_pplug_jarinu_etapa_data")
+
+
+def _v13_ocupacao_chave_tipos(cur):
+    """pu_ocupacao_chave recebe op::text e id::bigint explícitos: op numérico ou id bigint não quebram os triggers"""
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION public.pu_ocupacao_chave(p_op TEXT, p_id BIGINT)
+        RETURNS TEXT AS $$
+            SELECT CASE WHEN COALESCE(p_op, '') = '' THEN 'id:' || p_id ELSE p_op END
+        $$ LANGUAGE sql IMMUTABLE
+    """)
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION public.pu_ocupacao_trigger()
+        RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') AND COALESCE(to_jsonb(OLD)->>'tipo', 'PU') = 'PU' THEN
+                PERFORM public.pu_ocupacao_ajustar(OLD.local, OLD.peca, public.pu_ocupacao_chave(OLD.op::text, OLD.id::bigint), TG_ARGV[0], -1);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND COALESCE(to_jsonb(NEW)->>'tipo', 'PU') = 'PU' THEN
+                PERFORM public.pu_ocupacao_ajustar(NEW.local, NEW.peca, public.pu_ocupacao_chave(NEW.op::text, NEW.id::bigint), TG_ARGV[0], 1);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    cur.execute("DROP FUNCTION IF EXISTS public.pu_ocupacao_chave(TEXT, INTEGER)")
+
+
+def _garantir_versao_usuarios(cur):
+    """Trigger que incrementa pu_usuarios_versao; users_pu é criada por fora, então é verificado a cada inicialização"""
+    if not _tabela_existe(cur, 'users_pu'):
+        return
+    cur.execute("""
+        SELECT 1 FROM pg_trigger
+        WHERE tgname = 'trg_users_pu_versao' AND tgrelid = 'public.users_pu'::regclass
+    """)
+    if cur.fetchone():
+        return
+    cur.execute("""
+        CREATE TRIGGER trg_users_pu_versao
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.users_pu
+        FOR EACH STATEMENT EXECUTE FUNCTION public.pu_usuarios_incrementar()
+    """)
+
+
+# Texto pesquisado em /api/logs; a consulta precisa usar exatamente esta expressão para aproveitar o índice trigram
+EXPRESSAO_BUSCA_LOGS = "lower(coalesce(usuario, '') || ' ' || coalesce(acao, '') || ' ' || coalesce(detalhes, ''))"
+
+
+def _garantir_busca_logs(cur):
+    """Índice trigram da busca de logs; sem permissão para criar pg_trgm a busca continua funcionando, só que sem índice"""
+    cur.execute("SAVEPOINT busca_logs")
+    try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_pu_logs_busca_trgm
+            ON public.pu_logs USING gin (({EXPRESSAO_BUSCA_LOGS}) gin_trgm_ops)
+        """)
+        cur.execute("RELEASE SAVEPOINT busca_logs")
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT busca_logs")
+        print(f"Esquema: índice de busca dos logs não criado ({e})")
+
+
+# Texto pesquisado no histórico de saídas (/api/saidas e /api/saidas-exit), mesma regra da busca de logs
+EXPRESSAO_BUSCA_SAIDAS = (
+    "lower(coalesce(op_pai::text, '') || ' ' || coalesce(op::text, '') || ' ' || coalesce(peca, '') || ' ' || coalesce(projeto, '') || ' ' || "
+    "coalesce(veiculo, '') || ' ' || coalesce(local, '') || ' ' || coalesce(rack, '') || ' ' || "
+    "coalesce(usuario, '') || ' ' || coalesce(motivo, ''))"
+)
+
+
+def _garantir_busca_saidas(cur):
+    """Índice trigram da busca do histórico de saídas; sem pg_trgm a busca funciona sem índice"""
+    if not _tabela_existe(cur, 'pu_exit'):
+        return
+    cur.execute("SAVEPOINT busca_saidas")
+    try:
+        cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        cur.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_pu_exit_busca_trgm
+            ON public.pu_exit USING gin (({EXPRESSAO_BUSCA_SAIDAS}) gin_trgm_ops)
+        """)
+        cur.execute("RELEASE SAVEPOINT busca_saidas")
+    except Exception as e:
+        cur.execute("ROLLBACK TO SAVEPOINT busca_saidas")
+        print(f"Esquema: índice de busca das saídas não criado ({e})")
+
+
+# Migrações aplicadas em ordem, cada uma em sua transação e registrada em pu_schema_versao
+MIGRACOES = [
+    (1, 'locais com capacidade e topologia dos racks', _v1_locais_racks),
+    (2, 'tabelas de estoque, otimizadas e manuais', _v2_estoque_otimizadas_manuais),
+    (3, 'reservas de locais por peça', _v3_reservas),
+    (4, 'projeção de ocupação mantida por triggers', _v4_projecao_ocupacao),
+    (5, 'log de auditoria', _v5_logs),
+    (6, 'jobs em segundo plano', _v6_jobs),
+    (7, 'watermark da ingestão de apontamentos', _v7_ingestao_watermark),
+    (8, 'tabela de apontamentos do pplug', _v8_apontamentos),
+    (9, 'versão da topologia para o cache de alocação', _v9_topologia_versao),
+    (10, 'ocupação contada em peças, não em linhas de camada', _v10_ocupacao_por_peca),
+    (11, 'versão de users_pu para o cache de usuários', _v11_usuarios_versao),
+    (12, 'índice de apontamentos por UPPER(etapa)', _v12_indice_etapa_upper),
+    (13, 'chave de ocupação com op e id convertidos explicitamente', _v13_ocupacao_chave_tipos)
+]
+
+# Índices das consultas quentes; tabelas alimentadas por fora (apontamentos, arquivos, camadas)
+# podem ainda não existir, então são verificados a cada inicialização
+INDICES = [
+    ('idx_pu_inventory_local', 'pu_inventory', 'local'),
+    ('idx_pu_inventory_op_peca', 'pu_inventory', 'op, peca'),
+    ('idx_pu_otimizadas_tipo_local', 'pu_otimizadas', 'tipo, local'),
+    # Coleta incremental de /api/dados: linhas de estoque e otimizadas gravadas desde a última coleta
+    ('idx_pu_inventory_data', 'pu_inventory', 'data'),
+    ('idx_pu_otimizadas_tipo_data_otimizacao', 'pu_otimizadas', 'tipo, data_otimizacao'),
+    # /api/dados filtra por UPPER(etapa) = UPPER(%s): o índice precisa ser da mesma expressão
+    ('idx_apontamento_pplug_jarinu_upper_etapa_data', 'apontamento_pplug_jarinu', 'upper(etapa), data'),
+    ('idx_arquivos_pu_projeto_peca', 'arquivos_pu', 'projeto, peca'),
+    ('idx_pu_camadas_projeto_peca', 'pu_camadas', 'projeto, peca'),
+    # Histórico de saídas: paginação por id decrescente, com ou sem filtro
+    ('idx_pu_exit_data', 'pu_exit', 'data'),
+    ('idx_pu_exit_op_id', 'pu_exit', 'op, id'),
+    ('idx_pu_exit_peca_id', 'pu_exit', 'peca, id'),
+    ('idx_pu_exit_usuario_id', 'pu_exit', 'usuario, id'),
+    ('idx_pu_exit_motivo_id', 'pu_exit', 'motivo, id')
+]
+
+# Sequências que podem ficar atrás do MAX(id) quando linhas são importadas com id explícito
+SEQUENCIAS = [
+    ('arquivos_pu', 'arquivos_pu_id_seq')
+]
+
+
+def reconstruir_projecao_ocupacao(cur):
+    """Recalcula pu_ocupacao (peças por local e tipo) e as linhas por peça a partir das tabelas de origem, com as escritas bloqueadas"""
+    cur.execute("LOCK TABLE public.pu_inventory, public.pu_otimizadas, public.pu_manuais IN SHARE MODE")
+    cur.execute("DELETE FROM public.pu_ocupacao_pecas")
+    cur.execute("DELETE FROM public.pu_ocupacao")
+    cur.execute("""
+        INSERT INTO public.pu_ocupacao_pecas (local, peca, origem, chave, linhas)
+        SELECT local, peca, origem, chave, COUNT(*)
+        FROM (
+            SELECT local, COALESCE(peca, '') AS peca, 'estoque' AS origem, public.pu_ocupacao_chave(op::text, id::bigint) AS chave
+            FROM public.pu_inventory WHERE local IS NOT NULL AND local != ''
+            UNION ALL
+            SELECT local, COALESCE(peca, ''), 'otimizadas', public.pu_ocupacao_chave(op::text, id::bigint)
+            FROM public.pu_otimizadas WHERE tipo = 'PU' AND local IS NOT NULL AND local != ''
+            UNION ALL
+            SELECT local, COALESCE(peca, ''), 'manuais', public.pu_ocupacao_chave(op::text, id::bigint)
+            FROM public.pu_manuais WHERE local IS NOT NULL AND local != ''
+        ) AS origem
+        GROUP BY local, peca, origem, chave
+    """)
+    cur.execute("""
+        INSERT INTO public.pu_ocupacao (local, peca, estoque, otimizadas, manuais)
+        SELECT local, peca,
+               COUNT(*) FILTER (WHERE origem = 'estoque'),
+               COUNT(*) FILTER (WHERE origem = 'otimizadas'),
+               COUNT(*) FILTER (WHERE origem = 'manuais')
+        FROM public.pu_ocupacao_pecas
+        GROUP BY local, peca
+    """)
+
+
+def _tabela_existe(cur, tabela):
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (f'public.{tabela}',))
+    return cur.fetchone()[0]
+
+
+def aplicar_esquema(conn):
+    """Aplica as migrações pendentes, garante os índices e reconstrói a projeção de ocupação"""
+    cur = conn.cursor()
+    cur.execute("SELECT pg_advisory_lock(%s)", (CHAVE_LOCK_ESQUEMA,))
+    try:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS public.pu_schema_versao (
+                versao INTEGER PRIMARY KEY,
+                descricao TEXT,
+                aplicada_em TIMESTAMPTZ DEFAULT NOW()
+            )
+        """)
+        conn.commit()
+
+        cur.execute("SELECT versao FROM public.pu_schema_versao")
+        aplicadas = {row[0] for row in cur.fetchall()}
+
+        for versao, descricao, migracao in MIGRACOES:
+            if versao in aplicadas:
+                continue
+            migracao(cur)
+            cur.execute("INSERT INTO public.pu_schema_versao (versao, descricao) VALUES (%s, %s)", (versao, descricao))
+            conn.commit()
+            print(f"Esquema: migração {versao} aplicada ({descricao})")
+
+        for nome, tabela, colunas in INDICES:
+            if _tabela_existe(cur, tabela):
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {nome} ON public.{tabela} ({colunas})")
+        _garantir_id_unico_apontamentos(cur)
+        _garantir_versao_usuarios(cur)
+        _garantir_busca_logs(cur)
+        _garantir_busca_saidas(cur)
+        conn.commit()
+
+        for tabela, sequencia in SEQUENCIAS:
+            if _tabela_existe(cur, tabela):
+                cur.execute(
+                    f"SELECT setval(%s, (SELECT COALESCE(MAX(id), 0) + 1 FROM public.{tabela}), false)",
+                    (sequencia,)
+                )
+        conn.commit()
+
+        reconstruir_projecao_ocupacao(cur)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.execute("SELECT pg_advisory_unlock(%s)", (CHAVE_LOCK_ESQUEMA,))
+        conn.commit()
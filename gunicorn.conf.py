@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""Configuração do gunicorn: processos e threads ajustáveis pelas variáveis de ambiente"""
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORTA', '9995')}"
+
+# Vários processos com threads: uma exportação de XML lenta ocupa uma thread, não o servidor
+workers = int(os.getenv('WEB_WORKERS', str(min(multiprocessing.cpu_count() * 2 + 1, 8))))
+threads = int(os.getenv('WEB_THREADS', '8'))
+worker_class = 'gthread'
+
+# Exportações grandes (XML, Excel) podem passar de um minuto
+timeout = int(os.getenv('WEB_TIMEOUT', '120'))
+graceful_timeout = 30
+keepalive = 5
+
+# Importa o app uma vez no mestre: criar_app() aplica o esquema antes do fork dos workers
+preload_app = True
+
+accesslog = '-'
+errorlog = '-'
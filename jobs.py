@@ -0,0 +1,129 @@
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2.extras
+
+# Threads por processo que executam os jobs em segundo plano
+JOBS_WORKERS = int(os.getenv('JOBS_WORKERS', '2'))
+
+# Job ativo há mais tempo que isso foi abandonado (processo encerrado no meio da execução)
+JOBS_TEMPO_MAX_MINUTOS = int(os.getenv('JOBS_TEMPO_MAX_MINUTOS', '30'))
+
+# Jobs concluídos são mantidos por esse número de dias para consulta
+JOBS_RETENCAO_DIAS = int(os.getenv('JOBS_RETENCAO_DIAS', '30'))
+
+_executor = {'pool': None, 'pid': None}
+_lock_executor = threading.Lock()
+
+
+def _obter_executor():
+    """Cria o pool de threads no primeiro job de cada processo (threads não sobrevivem a um fork)"""
+    with _lock_executor:
+        if _executor['pool'] is None or _executor['pid'] != os.getpid():
+            _executor['pool'] = ThreadPoolExecutor(max_workers=JOBS_WORKERS, thread_name_prefix='job')
+            _executor['pid'] = os.getpid()
+        return _executor['pool']
+
+
+def criar_job(conn, tipo, usuario):
+    """Registra um job pendente do tipo ou reaproveita o que já está ativo; devolve (id, criado)"""
+    cur = conn.cursor()
+
+    cur.execute("""
+        UPDATE public.pu_jobs
+        SET status = 'erro', mensagem = 'Job abandonado: excedeu o tempo máximo de execução', concluido_em = CURRENT_TIMESTAMP
+        WHERE tipo = %s AND status IN ('pendente', 'executando')
+        AND criado_em < CURRENT_TIMESTAMP - make_interval(mins => %s)
+    """, (tipo, JOBS_TEMPO_MAX_MINUTOS))
+    cur.execute("""
+        DELETE FROM public.pu_jobs WHERE concluido_em < CURRENT_TIMESTAMP - make_interval(days => %s)
+    """, (JOBS_RETENCAO_DIAS,))
+
+    # O índice único parcial garante um só job ativo por tipo, mesmo entre processos
+    for _ in range(3):
+        cur.execute("""
+            INSERT INTO public.pu_jobs (id, tipo, usuario) VALUES (%s, %s, %s)
+            ON CONFLICT (tipo) WHERE status IN ('pendente', 'executando') DO NOTHING
+            RETURNING id
+        """, (uuid.uuid4().hex, tipo, usuario))
+        linha = cur.fetchone()
+        if linha:
+            return linha[0], True
+
+        cur.execute("""
+            SELECT id FROM public.pu_jobs WHERE tipo = %s AND status IN ('pendente', 'executando')
+        """, (tipo,))
+        linha = cur.fetchone()
+        if linha:
+            return linha[0], False
+        # O job ativo terminou entre o INSERT e o SELECT: tenta registrar de novo
+
+    raise RuntimeError(f'Não foi possível registrar o job {tipo}')
+
+
+def obter_job(conn, job_id):
+    """Situação do job com etapa, contagens e duração em segundos, ou None se não existir"""
+    cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+    cur.execute("""
+        SELECT id, tipo, status, etapa, detalhes, mensagem, usuario, criado_em, iniciado_em, concluido_em,
+               EXTRACT(EPOCH FROM COALESCE(concluido_em, CURRENT_TIMESTAMP) - iniciado_em) AS duracao_s
+        FROM public.pu_jobs WHERE id = %s
+    """, (job_id,))
+    row = cur.fetchone()
+    if row is None:
+        return None
+
+    job = dict(row)
+    for campo in ('criado_em', 'iniciado_em', 'concluido_em'):
+        job[campo] = job[campo].isoformat() if job[campo] else None
+    job['duracao_s'] = round(float(job['duracao_s']), 2) if job['duracao_s'] is not None else None
+    return job
+
+
+def _atualizar_job(obter_conexao, job_id, sql, params):
+    with obter_conexao() as conn:
+        cur = conn.cursor()
+        cur.execute(sql, params + (job_id,))
+        conn.commit()
+
+
+def _executar(job_id, funcao, obter_conexao):
+    """Executa a função do job registrando início, progresso e resultado em pu_jobs"""
+    def progresso(etapa, **contagens):
+        try:
+            _atualizar_job(obter_conexao, job_id, """
+                UPDATE public.pu_jobs SET etapa = %s, detalhes = detalhes || %s WHERE id = %s
+            """, (etapa, psycopg2.extras.Json(contagens)))
+        except Exception as e:
+            # Falha ao registrar progresso não interrompe o job
+            print(f"Aviso: progresso do job {job_id} não registrado: {e}")
+
+    _atualizar_job(obter_conexao, job_id, """
+        UPDATE public.pu_jobs SET status = 'executando', iniciado_em = CURRENT_TIMESTAMP WHERE id = %s
+    """, ())
+
+    try:
+        resultado = dict(funcao(progresso=progresso) or {})
+        status = 'concluido' if resultado.pop('success', True) else 'erro'
+        mensagem = resultado.pop('message', None)
+    except Exception as e:
+        status, mensagem, resultado = 'erro', str(e), {}
+
+    _atualizar_job(obter_conexao, job_id, """
+        UPDATE public.pu_jobs
+        SET status = %s, mensagem = %s, detalhes = detalhes || %s, concluido_em = CURRENT_TIMESTAMP
+        WHERE id = %s
+    """, (status, mensagem, psycopg2.extras.Json(resultado)))
+
+
+def iniciar_job(obter_conexao, tipo, usuario, funcao):
+    """Agenda funcao(progresso=...) em segundo plano, uma execução por vez para cada tipo; devolve (id, criado)"""
+    with obter_conexao() as conn:
+        job_id, criado = criar_job(conn, tipo, usuario)
+        conn.commit()
+
+    if criado:
+        _obter_executor().submit(_executar, job_id, funcao, obter_conexao)
+    return job_id, criado
@@ -34,19 +34,58 @@ document.addEventListener('DOMContentLoaded', () => {
     });
 });
 
+// Watermark da última coleta; enquanto os filtros não mudam a próxima coleta é incremental
+let ultimaColeta = null;
+
+function adicionarLinhaDados(tbody, item, index) {
+    const row = tbody.insertRow();
+    row.className = 'hover:bg-gray-50';
+    row.setAttribute('data-row-id', index);
+    row.setAttribute('data-chave', `${item.op}_${item.peca}`);
+    
+    const checkCell = row.insertCell();
+    checkCell.innerHTML = `<input type="checkbox" class="row-checkbox" data-index="${index}" onchange="atualizarContador()">`;
+    checkCell.className = 'border border-gray-200 px-4 py-3 text-center';
+    
+    [item.op, item.peca, item.projeto, item.veiculo, item.local, item.rack].forEach(value => {
+        const cell = row.insertCell();
+        cell.textContent = value || '-';
+        cell.className = 'border border-gray-200 px-4 py-3';
+    });
+    
+    // Coluna de arquivo
+    const arquivoCell = row.insertCell();
+    arquivoCell.textContent = item.arquivo_status || 'Sem arquivo de corte';
+    arquivoCell.className = 'border border-gray-200 px-4 py-3 text-center';
+    if (item.arquivo_status === 'Sem arquivo de corte') {
+        arquivoCell.style.color = '#dc2626';
+    } else {
+        arquivoCell.style.color = '#16a34a';
+    }
+    
+    const cellAcoes = row.insertCell();
+    cellAcoes.innerHTML = `<i onclick="deletarLinha(this)" class="fas fa-trash text-red-500 hover:text-red-700 cursor-pointer"></i>`;
+    cellAcoes.className = 'border border-gray-200 px-4 py-3 text-center';
+}
+
 async function coletarDados() {
     const tbody = document.getElementById('dados-tbody');
     const btn = document.getElementById('btnColeta');
     
-    tbody.innerHTML = '<tr><td colspan="9" class="border border-gray-200 px-4 py-6 text-center text-gray-500">Carregando dados...</td></tr>';
+    const dataInicio = document.getElementById('dataInicio').value;
+    const dataFim = document.getElementById('dataFim').value;
+    const etapa = document.getElementById('etapa').value;
+    const filtros = `${dataInicio}|${dataFim}|${etapa}`;
+    const incremental = ultimaColeta !== null && ultimaColeta.filtros === filtros && tbody.querySelector('.row-checkbox') !== null;
+    
+    if (!incremental) {
+        tbody.innerHTML = '<tr><td colspan="9" class="border border-gray-200 px-4 py-6 text-center text-gray-500">Carregando dados...</td></tr>';
+    }
     btn.disabled = true;
     btn.innerHTML = '<i class="fas fa-spinner fa-spin mr-2"></i>Carregando...';
     
     try {
         const params = new URLSearchParams();
-        const dataInicio = document.getElementById('dataInicio').value;
-        const dataFim = document.getElementById('dataFim').value;
-        const etapa = document.getElementById('etapa').value;
         
         console.log('Etapa selecionada:', etapa);
         
@@ -54,6 +93,11 @@ async function coletarDados() {
         if (dataFim) params.append('data_fim', dataFim);
         params.append('etapa', etapa);
         
+        if (incremental) {
+            params.append('desde_id', ultimaColeta.id);
+            params.append('coletado_em', ultimaColeta.coletadoEm);
+        }
+        
         const url = '/api/dados' + (params.toString() ? '?' + params.toString() : '');
         console.log('URL da requisição:', url);
         
@@ -65,41 +109,39 @@ async function coletarDados() {
         }
         
         const dados = await response.json();
-        console.log('Dados recebidos:', dados.length, 'itens');
         
-        tbody.innerHTML = '';
-        dados.forEach((item, index) => {
-            const row = tbody.insertRow();
-            row.className = 'hover:bg-gray-50';
-            row.setAttribute('data-row-id', index);
-            
-            const checkCell = row.insertCell();
-            checkCell.innerHTML = `<input type="checkbox" class="row-checkbox" data-index="${index}" onchange="atualizarContador()">`;
-            checkCell.className = 'border border-gray-200 px-4 py-3 text-center';
+        if (incremental) {
+            console.log('Coleta incremental:', dados.novos.length, 'novos,', dados.removidos.length, 'removidos');
             
-            [item.op, item.peca, item.projeto, item.veiculo, item.local, item.rack].forEach(value => {
-                const cell = row.insertCell();
-                cell.textContent = value || '-';
-                cell.className = 'border border-gray-200 px-4 py-3';
+            dados.removidos.forEach(item => {
+                const row = tbody.querySelector(`tr[data-chave="${CSS.escape(`${item.op}_${item.peca}`)}"]`);
+                if (row) row.remove();
             });
             
-            // Coluna de arquivo
-            const arquivoCell = row.insertCell();
-            arquivoCell.textContent = item.arquivo_status || 'Sem arquivo de corte';
-            arquivoCell.className = 'border border-gray-200 px-4 py-3 text-center';
-            if (item.arquivo_status === 'Sem arquivo de corte') {
-                arquivoCell.style.color = '#dc2626';
-            } else {
-                arquivoCell.style.color = '#16a34a';
-            }
+            let index = tbody.rows.length;
+            dados.novos.forEach(item => {
+                if (!tbody.querySelector(`tr[data-chave="${CSS.escape(`${item.op}_${item.peca}`)}"]`)) {
+                    adicionarLinhaDados(tbody, item, index++);
+                }
+            });
             
-            const cellAcoes = row.insertCell();
-            cellAcoes.innerHTML = `<i onclick="deletarLinha(this)" class="fas fa-trash text-red-500 hover:text-red-700 cursor-pointer"></i>`;
-            cellAcoes.className = 'border border-gray-200 px-4 py-3 text-center';
-        });
+            ultimaColeta = { filtros, id: dados.watermark.id, coletadoEm: dados.watermark.coletado_em };
+            atualizarContador();
+            return;
+        }
+        
+        console.log('Dados recebidos:', dados.length, 'itens');
+        
+        tbody.innerHTML = '';
+        dados.forEach((item, index) => adicionarLinhaDados(tbody, item, index));
+        
+        const watermarkId = response.headers.get('X-Watermark-Id');
+        const coletadoEm = response.headers.get('X-Coletado-Em');
+        ultimaColeta = watermarkId && coletadoEm ? { filtros, id: watermarkId, coletadoEm } : null;
         
     } catch (error) {
         console.error('Erro na coleta de dados:', error);
+        ultimaColeta = null;
         tbody.innerHTML = `<tr><td colspan="9" class="border border-gray-200 px-4 py-6 text-center text-gray-500">Erro ao carregar dados: ${error.message}</td></tr>`;
     } finally {
         btn.disabled = false;
@@ -365,6 +407,7 @@ document.getElementById('formAdicionar').addEventListener('submit', async functi
                 const tbody = document.getElementById('dados-tbody');
                 const row = tbody.insertRow(0);
                 row.className = 'hover:bg-gray-50';
+                row.setAttribute('data-chave', `${result.peca.op}_${result.peca.peca}`);
                 
                 const checkCell = row.insertCell();
                 checkCell.innerHTML = `<input type="checkbox" class="row-checkbox" data-index="0">`;
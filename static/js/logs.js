@@ -1,6 +1,8 @@
 let paginaAtual = 1;
 const itensPorPagina = 20;
 let timeoutBusca;
+// Cursor (id) de início de cada página já visitada da busca atual
+let cursoresPaginas = [null];
 
 document.addEventListener('DOMContentLoaded', () => {
     carregarLogs();
@@ -15,14 +17,14 @@ document.addEventListener('DOMContentLoaded', () => {
 });
 
 async function carregarLogs(pagina = 1) {
+    // Voltar à primeira página (nova busca) descarta os cursores anteriores
+    if (pagina === 1) cursoresPaginas = [null];
     paginaAtual = pagina;
     const tbody = document.getElementById('logs-tbody');
     
     try {
-        const params = new URLSearchParams({
-            page: pagina,
-            limit: itensPorPagina
-        });
+        const params = new URLSearchParams({ limit: itensPorPagina });
+        if (cursoresPaginas[pagina - 1]) params.append('cursor', cursoresPaginas[pagina - 1]);
         
         const busca = document.getElementById('campoBusca').value;
         if (busca) params.append('busca', busca);
@@ -39,6 +41,7 @@ async function carregarLogs(pagina = 1) {
         
         if (data.dados.length === 0) {
             tbody.innerHTML = '<tr><td colspan="4" class="border border-gray-200 px-4 py-6 text-center text-gray-500">Nenhum log encontrado</td></tr>';
+            document.getElementById('paginacao').innerHTML = '';
             return;
         }
         
@@ -66,34 +69,29 @@ function criarPaginacao(pagination) {
     const container = document.getElementById('paginacao');
     container.innerHTML = '';
     
-    if (pagination.total_pages <= 1) return;
+    if (pagination.tem_mais) cursoresPaginas[paginaAtual] = pagination.proximo_cursor;
+    if (paginaAtual === 1 && !pagination.tem_mais) return;
     
     // Botão Anterior
     const btnAnterior = document.createElement('button');
     btnAnterior.textContent = 'Anterior';
     btnAnterior.className = 'btn-pagination';
-    btnAnterior.disabled = pagination.current_page === 1;
-    btnAnterior.onclick = () => carregarLogs(pagination.current_page - 1);
+    btnAnterior.disabled = paginaAtual === 1;
+    btnAnterior.onclick = () => carregarLogs(paginaAtual - 1);
     container.appendChild(btnAnterior);
     
-    // Números das páginas
-    const inicio = Math.max(1, pagination.current_page - 2);
-    const fim = Math.min(pagination.total_pages, pagination.current_page + 2);
-    
-    for (let i = inicio; i <= fim; i++) {
-        const btnPagina = document.createElement('button');
-        btnPagina.textContent = i;
-        btnPagina.className = `btn-pagination ${i === pagination.current_page ? 'bg-blue-600' : ''}`;
-        btnPagina.onclick = () => carregarLogs(i);
-        container.appendChild(btnPagina);
-    }
+    // Página atual
+    const infoPagina = document.createElement('span');
+    infoPagina.textContent = `Página ${paginaAtual}`;
+    infoPagina.className = 'px-3 text-sm text-gray-700';
+    container.appendChild(infoPagina);
     
     // Botão Próximo
     const btnProximo = document.createElement('button');
     btnProximo.textContent = 'Próximo';
     btnProximo.className = 'btn-pagination';
-    btnProximo.disabled = pagination.current_page === pagination.total_pages;
-    btnProximo.onclick = () => carregarLogs(pagination.current_page + 1);
+    btnProximo.disabled = !pagination.tem_mais;
+    btnProximo.onclick = () => carregarLogs(paginaAtual + 1);
     container.appendChild(btnProximo);
 }
 
@@ -131,7 +129,7 @@ function sortTable(columnIndex) {
 async function gerarExcel() {
     try {
         const busca = document.getElementById('campoBusca').value;
-        const params = new URLSearchParams({ page: 1, limit: 10000 });
+        const params = new URLSearchParams({ limit: 10000 });
         if (busca) params.append('busca', busca);
         
         const response = await fetch(`/api/logs?${params}`);
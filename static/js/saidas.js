@@ -1,13 +1,25 @@
 let paginaAtual = 1;
-let totalPaginas = 1;
+let temProximaPagina = false;
+// Cursor (id) de início de cada página já visitada; a página 1 começa do registro mais recente
+let cursoresPaginas = [null];
+let timeoutBuscaSaidas;
 
 document.addEventListener('DOMContentLoaded', function() {
     carregarSaidas();
 });
 
 async function carregarSaidas(pagina = 1) {
+    // Voltar à primeira página (nova busca) descarta os cursores anteriores
+    if (pagina === 1) cursoresPaginas = [null];
     try {
-        const response = await fetch(`/api/saidas?page=${pagina}&limit=20`);
+        const params = new URLSearchParams({ limit: 20 });
+        if (cursoresPaginas[pagina - 1]) params.append('cursor', cursoresPaginas[pagina - 1]);
+        
+        const campoBusca = document.getElementById('campoPesquisaSaidas');
+        const busca = campoBusca ? campoBusca.value.trim() : '';
+        if (busca) params.append('busca', busca);
+        
+        const response = await fetch(`/api/saidas?${params.toString()}`);
         const result = await response.json();
         
         const tbody = document.getElementById('saidas-tbody');
@@ -50,14 +62,15 @@ async function carregarSaidas(pagina = 1) {
         });
         
         if (result.pagination) {
-            paginaAtual = result.pagination.current_page;
-            totalPaginas = result.pagination.total_pages;
+            paginaAtual = pagina;
+            temProximaPagina = result.pagination.tem_mais;
+            if (temProximaPagina) cursoresPaginas[pagina] = result.pagination.proximo_cursor;
             
-            document.getElementById('infoPagina').textContent = `Página ${paginaAtual} de ${totalPaginas}`;
+            document.getElementById('infoPagina').textContent = `Página ${paginaAtual}`;
             document.getElementById('btnAnterior').disabled = paginaAtual <= 1;
-            document.getElementById('btnProximo').disabled = paginaAtual >= totalPaginas;
+            document.getElementById('btnProximo').disabled = !temProximaPagina;
             
-            document.getElementById('paginacao').style.display = totalPaginas > 1 ? 'flex' : 'none';
+            document.getElementById('paginacao').style.display = paginaAtual > 1 || temProximaPagina ? 'flex' : 'none';
         }
         
     } catch (error) {
@@ -69,18 +82,15 @@ async function carregarSaidas(pagina = 1) {
 
 function mudarPagina(direcao) {
     const novaPagina = paginaAtual + direcao;
-    if (novaPagina >= 1 && novaPagina <= totalPaginas) {
+    if (novaPagina >= 1 && (direcao < 0 || temProximaPagina)) {
         carregarSaidas(novaPagina);
     }
 }
 
 function filtrarTabelaSaidas() {
-    const filtro = document.getElementById('campoPesquisaSaidas').value.toLowerCase();
-    const linhas = document.querySelectorAll('#saidas-tbody tr');
-    linhas.forEach(linha => {
-        const textoLinha = linha.textContent.toLowerCase();
-        linha.style.display = textoLinha.includes(filtro) ? '' : 'none';
-    });
+    // A busca vai para o servidor e cobre todo o histórico, não só a página carregada
+    clearTimeout(timeoutBuscaSaidas);
+    timeoutBuscaSaidas = setTimeout(() => carregarSaidas(1), 300);
 }
 
 let sortDirection = {};
@@ -1,18 +1,54 @@
+// Cursor da próxima página do histórico (null quando não há mais registros)
+let proximoCursorExit = null;
+let timeoutBuscaExit;
+// Número da última consulta disparada; respostas de consultas anteriores são descartadas
+let consultaExitAtual = 0;
+
 document.addEventListener('DOMContentLoaded', function() {
     carregarSaidasExit();
+    
+    // Pesquisa e datas são filtradas no servidor: qualquer mudança recomeça do primeiro registro
+    document.getElementById('campoPesquisaExit').addEventListener('input', () => {
+        clearTimeout(timeoutBuscaExit);
+        timeoutBuscaExit = setTimeout(() => carregarSaidasExit(), 300);
+    });
+    ['dataInicioExit', 'dataFimExit'].forEach(id => {
+        document.getElementById(id).addEventListener('change', () => carregarSaidasExit());
+    });
 });
 
-async function carregarSaidasExit() {
+function filtrosSaidasExit() {
+    const filtros = {};
+    const busca = document.getElementById('campoPesquisaExit').value.trim();
+    const dataInicio = document.getElementById('dataInicioExit').value;
+    const dataFim = document.getElementById('dataFimExit').value;
+    if (busca) filtros.busca = busca;
+    if (dataInicio) filtros.data_inicio = dataInicio;
+    if (dataFim) filtros.data_fim = dataFim;
+    return filtros;
+}
+
+async function carregarSaidasExit(cursor = null) {
+    const tbody = document.getElementById('exit-tbody');
+    const btnMais = document.getElementById('btnCarregarMaisExit');
+    const consulta = ++consultaExitAtual;
+    
     try {
-        const response = await fetch('/api/saidas-exit');
-        const dados = await response.json();
+        const params = new URLSearchParams({ limit: 200, ...filtrosSaidasExit() });
+        if (cursor) params.append('cursor', cursor);
+        
+        const response = await fetch(`/api/saidas-exit?${params.toString()}`);
+        const result = await response.json();
         
-        const tbody = document.getElementById('exit-tbody');
-        tbody.innerHTML = '';
+        if (consulta !== consultaExitAtual) return;
+        if (result.error) throw new Error(result.error);
         
-        if (!dados || dados.length === 0) {
+        const dados = result.dados || [];
+        
+        if (!cursor) tbody.innerHTML = '';
+        
+        if (!cursor && dados.length === 0) {
             tbody.innerHTML = '<tr><td colspan="9" class="border border-gray-200 px-4 py-6 text-center text-gray-500">Nenhuma saída encontrada</td></tr>';
-            return;
         }
         
         dados.forEach(item => {
@@ -36,18 +72,20 @@ async function carregarSaidasExit() {
             });
         });
         
+        proximoCursorExit = result.pagination && result.pagination.tem_mais ? result.pagination.proximo_cursor : null;
+        if (btnMais) btnMais.style.display = proximoCursorExit ? '' : 'none';
+        
     } catch (error) {
+        if (consulta !== consultaExitAtual) return;
         console.error('Erro ao carregar saídas:', error);
-        const tbody = document.getElementById('exit-tbody');
-        tbody.innerHTML = '<tr><td colspan="9" class="border border-gray-200 px-4 py-6 text-center text-red-500">Erro ao carregar dados</td></tr>';
+        if (!cursor) {
+            tbody.innerHTML = '<tr><td colspan="9" class="border border-gray-200 px-4 py-6 text-center text-red-500">Erro ao carregar dados</td></tr>';
+            proximoCursorExit = null;
+            if (btnMais) btnMais.style.display = 'none';
+        }
     }
 }
 
-function filtrarTabelaExit() {
-    const filtro = document.getElementById('campoPesquisaExit').value.toLowerCase();
-    
-    document.querySelectorAll('#exit-tbody tr').forEach(linha => {
-        const match = linha.textContent.toLowerCase().includes(filtro);
-        linha.style.display = match ? '' : 'none';
-    });
-}
\ No newline at end of file
+function carregarMaisSaidasExit() {
+    if (proximoCursorExit) carregarSaidasExit(proximoCursorExit);
+}
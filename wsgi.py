@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+"""Ponto de entrada WSGI para produção: gunicorn -c gunicorn.conf.py wsgi:app"""
+
+from app import criar_app
+
+app = criar_app()